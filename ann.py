@@ -0,0 +1,191 @@
+import os,json,argparse
+import numpy as np
+from scipy import sparse
+
+KMEANS_ITERATIONS = 20
+# the centroids are trained on a sample of the vectors
+KMEANS_SAMPLE = 100000
+ASSIGN_CHUNK_ROWS = 100000
+PQ_CENTROIDS = 256
+# with PQ and the original vectors, refine times k candidates are re-scored exactly
+REFINE_FACTOR = 4
+
+# the nearest centroid (L2) of each vector, by chunks of vectors
+def assign(vectors,centroids,chunk_rows=ASSIGN_CHUNK_ROWS):
+    centroid_norms = (centroids*centroids).sum(1)
+    labels = np.zeros(len(vectors),dtype=np.int64)
+    for start in range(0,len(vectors),chunk_rows):
+        chunk = np.asarray(vectors[start:start+chunk_rows],dtype=np.float32)
+        labels[start:start+len(chunk)] = np.argmin(centroid_norms[None,:]-2*chunk@centroids.T,axis=1)
+    return labels
+
+def kmeans(vectors,k,iterations=KMEANS_ITERATIONS,rng=None):
+    rng = rng or np.random.default_rng(0)
+    vectors = np.asarray(vectors,dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors),k,replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors,centroids)
+        # sums of the vectors of each cluster in one sparse product
+        onehot = sparse.csr_matrix((np.ones(len(labels),dtype=np.float32),(labels,np.arange(len(labels)))),shape=(k,len(labels)))
+        counts = np.bincount(labels,minlength=k)
+        sums = onehot@vectors
+        filled = counts > 0
+        centroids[filled] = sums[filled]/counts[filled,None]
+        # an empty cluster restarts from a random vector
+        centroids[~filled] = vectors[rng.choice(len(vectors),int((~filled).sum()),replace=False)]
+    return centroids
+
+
+# IVF: the vectors are split into nlist lists by a k-means coarse quantizer, a query scores only the vectors of its nprobe best lists
+# the vectors of list l are ids[list_offsets[l]:list_offsets[l+1]], stored as is (vectors) or product quantized (codes)
+# PQ: the residual to the list centroid is cut into pq_m subvectors, each encoded by the nearest of 256 sub-centroids (a uint8)
+# scores are inner products, as the dot product of the dual encoder (match.PIXNETNET)
+class IVFIndex():
+    def __init__(self,centroids,list_offsets,ids,vectors=None,codebooks=None,codes=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.codebooks = codebooks
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nlist(self):
+        return len(self.centroids)
+
+    # the scores of the queries qs with the vectors of a list
+    def score_list(self,queries,qs,lst,coarse,luts):
+        start,end = self.list_offsets[lst],self.list_offsets[lst+1]
+        if self.codes is None:
+            return queries[qs]@np.asarray(self.vectors[start:end],dtype=np.float32).T
+        # q.v = q.centroid + sum of the look-up tables of the codes of the residual
+        codes = np.asarray(self.codes[start:end],dtype=np.int64)
+        pq_scores = luts[qs][:,np.arange(codes.shape[1])[None,:],codes].sum(2)
+        return coarse[qs,lst][:,None]+pq_scores
+
+    # batched top-k search, queries: (Q,dim)
+    # rerank_vectors: the original vectors (eg. the memory-mapped CommentBank.embeddings) to re-score the PQ candidates exactly
+    # return: ids (Q,k) and scores (Q,k) by descending score, -1 and -inf when fewer than k vectors are probed
+    def search(self,queries,k=10,nprobe=8,rerank_vectors=None,refine=REFINE_FACTOR):
+        queries = np.atleast_2d(np.asarray(queries,dtype=np.float32))
+        if self.codes is None or rerank_vectors is None:
+            return self.search_lists(queries,k,nprobe)
+        ids,_ = self.search_lists(queries,k*refine,nprobe)
+        found = ids >= 0
+        scores = np.full(ids.shape,-np.inf,dtype=np.float32)
+        rows = ids[found]
+        # the rows are read in sorted order, which is sequential on a memory-mapped file
+        order = np.argsort(rows)
+        candidates = np.empty((len(rows),queries.shape[1]),dtype=np.float32)
+        candidates[order] = np.asarray(rerank_vectors[rows[order]],dtype=np.float32)
+        scores[found] = (candidates*np.repeat(queries,found.sum(1),axis=0)).sum(1)
+        top = np.argsort(-scores,axis=1,kind='stable')[:,:k]
+        ids,scores = np.take_along_axis(ids,top,1),np.take_along_axis(scores,top,1)
+        ids[scores == -np.inf] = -1
+        return ids,scores
+
+    def search_lists(self,queries,k,nprobe):
+        nprobe = min(nprobe,self.nlist())
+        coarse = queries@self.centroids.T
+        probes = np.argpartition(-coarse,nprobe-1,axis=1)[:,:nprobe]
+        luts = None
+        if self.codes is not None:
+            m,_,dsub = self.codebooks.shape
+            luts = np.einsum('qmd,mcd->qmc',queries.reshape(len(queries),m,dsub),self.codebooks)
+
+        # each probed list is scored against all of its queries at once
+        candidate_ids = [[] for _ in range(len(queries))]
+        candidate_scores = [[] for _ in range(len(queries))]
+        for lst in np.unique(probes):
+            start,end = self.list_offsets[lst],self.list_offsets[lst+1]
+            if start == end:
+                continue
+            qs = np.nonzero((probes == lst).any(1))[0]
+            scores = self.score_list(queries,qs,lst,coarse,luts)
+            ids = np.asarray(self.ids[start:end])
+            for row,q in enumerate(qs):
+                candidate_ids[q].append(ids)
+                candidate_scores[q].append(scores[row])
+
+        result_ids = np.full((len(queries),k),-1,dtype=np.int64)
+        result_scores = np.full((len(queries),k),-np.inf,dtype=np.float32)
+        for q in range(len(queries)):
+            if not candidate_ids[q]:
+                continue
+            ids,scores = np.concatenate(candidate_ids[q]),np.concatenate(candidate_scores[q])
+            top = np.argpartition(-scores,min(k,len(scores))-1)[:k]
+            top = top[np.argsort(-scores[top],kind='stable')]
+            result_ids[q,:len(top)] = ids[top]
+            result_scores[q,:len(top)] = scores[top]
+        return result_ids,result_scores
+
+    def save(self,folder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        names = [name for name in ['centroids','list_offsets','ids','vectors','codebooks','codes'] if getattr(self,name) is not None]
+        for name in names:
+            np.save(os.path.join(folder,'%s.npy'%(name)),getattr(self,name))
+        with open(os.path.join(folder,'meta.json'),'w') as f:
+            json.dump({'arrays':names,'rows':len(self),'nlist':self.nlist(),'pq':self.codes is not None},f)
+
+    @staticmethod
+    def load(folder,mmap=True):
+        with open(os.path.join(folder,'meta.json'),'r') as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        arrays = {name:np.load(os.path.join(folder,'%s.npy'%(name)),mmap_mode=mode) for name in meta['arrays']}
+        # the centroids and the codebooks are small and used by every query
+        for name in ['centroids','codebooks']:
+            if name in arrays:
+                arrays[name] = np.array(arrays[name])
+        return IVFIndex(**arrays)
+
+    # vectors: (N,dim), eg. CommentBank.embeddings; the ids are the row indices of vectors
+    # nlist: default as about sqrt(N) lists; pq_m: the number of PQ subvectors, 0 to store the vectors as is
+    @staticmethod
+    def build(vectors,nlist=None,pq_m=0,iterations=KMEANS_ITERATIONS,sample=KMEANS_SAMPLE,seed=0):
+        rng = np.random.default_rng(seed)
+        N,dim = vectors.shape
+        nlist = min(nlist or max(1,int(np.sqrt(N))),N)
+        sample_rows = np.sort(rng.choice(N,min(sample,N),replace=False))
+        training = np.asarray(vectors[sample_rows],dtype=np.float32)
+        centroids = kmeans(training,nlist,iterations,rng)
+
+        labels = assign(vectors,centroids)
+        ids = np.argsort(labels,kind='stable')
+        list_offsets = np.zeros(nlist+1,dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(labels,minlength=nlist))
+        if pq_m <= 0:
+            return IVFIndex(centroids,list_offsets,ids,vectors=np.asarray(vectors[ids]))
+
+        if dim % pq_m != 0:
+            raise ValueError('the dimension %d is not divisible by pq_m %d'%(dim,pq_m))
+        dsub = dim//pq_m
+        ks = min(PQ_CENTROIDS,len(training))
+        residuals = (training-centroids[assign(training,centroids)]).reshape(len(training),pq_m,dsub)
+        codebooks = np.stack([kmeans(residuals[:,j],ks,iterations,rng) for j in range(pq_m)])
+        codes = np.zeros((N,pq_m),dtype=np.uint8)
+        for start in range(0,N,ASSIGN_CHUNK_ROWS):
+            rows = ids[start:start+ASSIGN_CHUNK_ROWS]
+            chunk = np.asarray(vectors[rows],dtype=np.float32)-centroids[labels[rows]]
+            chunk = chunk.reshape(len(rows),pq_m,dsub)
+            for j in range(pq_m):
+                codes[start:start+len(rows),j] = assign(chunk[:,j],codebooks[j])
+        return IVFIndex(centroids,list_offsets,ids,codebooks=codebooks,codes=codes)
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='build the IVF index of a comment bank')
+    parser.add_argument('-b','--bank_dir',default='./comment_bank')
+    parser.add_argument('-o','--output_dir',default='./comment_ann')
+    parser.add_argument('--nlist',default=None,type=int)
+    parser.add_argument('--pq_m',default=0,type=int)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arg = parse()
+    # the embeddings of retrieval.build_comment_bank
+    embeddings = np.load(os.path.join(arg.bank_dir,'embeddings.npy'),mmap_mode='r')
+    IVFIndex.build(embeddings,arg.nlist,arg.pq_m).save(arg.output_dir)
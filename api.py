@@ -2,13 +2,14 @@ import sqlite3
 import os
 import csv
 import random
-import jieba
 import math
 import re
-from bs4 import BeautifulSoup, Comment
-from sklearn.metrics.pairwise import cosine_similarity
+from tfidfEngine import TFIDFMatrix
 import numpy as np
 import collections
+import heapq
+from segmenter import Segmenter, get_segmenter, get_cache, remove_invalid
+from migrate import migrate, setVersion
 csv.field_size_limit(100000000)
 
 # Data file processing
@@ -28,7 +29,8 @@ def initDB(conn = sqlite3.connect(DB_FILE), closeConnection = False):
     c.execute('''DROP TABLE IF EXISTS comments''')
     c.execute('''DROP TABLE IF EXISTS tags''')
     c.execute('''DROP TABLE IF EXISTS keywords''')
-    conn.commit()
+    # The indexes are dropped with the tables, so the migrations should be applied again
+    setVersion(conn, 0)
 
     # Create tables
     print("DB Initiation - Creating tables")
@@ -168,6 +170,46 @@ def getData(conn = sqlite3.connect(DB_FILE), table = "", id1 = None, id2 = None)
         return cur.fetchone()
 
 
+def sampleTopByCount(candidates, retreiveCount = None, rng = None):
+    '''
+        Rank candidates by descending count, in a random order among equal counts.
+        The cost is proportional to the number of candidates instead of the size of the table.
+
+        Parameters
+        ====================================
+
+        candidates      `list[tuple(int, float)]` - (id, count) pairs, eg. the rows of a GROUP BY query.
+        retreiveCount   `None|int` - The topmost k ids, all if None is given.
+        rng             `random.Random` - The random generator for tie-breaking. Default as the global random module.
+
+        Returns
+        ====================================
+
+        `list[int]`  - The ranked ids.
+    '''
+    rng = rng or random
+    keyed = [(-count, rng.random(), cid) for cid, count in candidates]
+    keyed = sorted(keyed) if retreiveCount is None else heapq.nsmallest(retreiveCount, keyed)
+    return [k[2] for k in keyed]
+
+
+def numpyRandom(rng = None):
+    '''
+        Get a numpy random generator following a random.Random, for the vectorized paths.
+
+        Parameters
+        ====================================
+
+        rng     `random.Random` - The random generator, None for the global numpy random state.
+
+        Returns
+        ====================================
+
+        `np.random.Generator|None`  - The numpy random generator.
+    '''
+    return None if rng is None else np.random.default_rng(rng.getrandbits(64))
+
+
 class Blog:
     '''
         Class representing a blog item.
@@ -226,7 +268,7 @@ class Blog:
         comments = cur.fetchall()
         return [Comment(*c) for c in comments]
 
-    def getOtherComments(self, retreiveCount = 5, blog_ids = None):
+    def getOtherComments(self, retreiveCount = 5, blog_ids = None, sampler = None, rng = None, mode = "random", hardRatio = 0.5, similarArgs = None):
         '''
             Get a list of comments not in this blog.
 
@@ -235,12 +277,20 @@ class Blog:
 
             retreiveCount   `int` - The topmost k comments, recommend a small integer smaller than 30
             blog_ids  `list[int]` - A pre-fetched blog_id list
+            sampler         `None|NegativeSampler` - Sample from the preloaded comment keys instead of the blog_id list, the arguments below are only used with a sampler.
+            rng             `random.Random` - The random generator of the sampler.
+            mode            `str`   - "random": comments of any other blogs; "hard": a hardRatio of the comments from the blogs of getSimilarBlogs.
+            hardRatio       `float` - The ratio of the hard negatives.
+            similarArgs     `dict`  - The keyword arguments of getSimilarBlogs for the hard negatives.
 
             Returns
             ====================================
 
             `list(Comment)`  - a list of Comment objects.
         '''
+        if sampler is not None:
+            return [Comment(*c) for c in sampler.sampleRows(self, retreiveCount, rng, mode, hardRatio, similarArgs)]
+
         cur = self.conn.cursor()
         if blog_ids is None:
             blog_ids = Blog.getIDs(self.conn)
@@ -254,7 +304,7 @@ class Blog:
         comments = cur.fetchall()
         return [Comment(*c) for c in comments]
     
-    def getSimilarBlogsByKeywords(self, retreiveCount = 5, logKeywords = False):
+    def getSimilarBlogsByKeywords(self, retreiveCount = 5, logKeywords = False, rng = None, invertedIndex = None):
         '''
             Get a list of blogs with the same keywords as this blog.
 
@@ -263,11 +313,13 @@ class Blog:
 
             retreiveCount   `None|int` - The topmost k comments, all if None is given.
             logKeywords     `bool`      - Whether to log the keywords found in this blog.
+            rng             `random.Random` - The random generator for tie-breaking. Default as the global random module.
+            invertedIndex   `InvertedIndex` - An index built from the keywords table, used instead of the SQL query if given.
 
             Returns
             ====================================
 
-            `list(Blog)`  - a list of Blog objects.
+            `list(Blog)`  - a list of Blog objects, sorted by the number of matched keywords.
 
         '''
         cur = self.conn.cursor()
@@ -277,21 +329,16 @@ class Blog:
             cur.execute("SELECT keywords FROM keywords WHERE blog_id = " + str(self.blog_id))
             print("Keywords:\n", [r[0] for r in cur.fetchall()])
 
-        # Select a list of blogs.
-        cur.execute("SELECT * FROM blogs "+
-                    "WHERE blog_id IN "+
-                        "(SELECT blog_id "+
-                            # From a shuffled keywords table.
-                            "FROM (SELECT * FROM keywords ORDER BY RANDOM()) " +
-                            # The keywords should be in those keywords of this blog
-                            "WHERE blog_id != " + str(self.blog_id) +" AND keywords IN (SELECT keywords FROM keywords WHERE blog_id = " + str(self.blog_id) + ") "+
-                            "GROUP BY blog_id "+
-                            "ORDER BY COUNT(keywords_id) DESC" + 
-                            ("" if retreiveCount is None else (" LIMIT " + str(retreiveCount))) + 
-                        ") ")
-        return [Blog(*b, self.conn) for b in cur.fetchall()]
+        if invertedIndex is not None:
+            return Blog.getManyFromDB(invertedIndex.query(self.blog_id, retreiveCount, numpyRandom(rng)), self.conn)
+
+        # Count the matched keywords of the candidate blogs, the keywords should be in those keywords of this blog
+        cur.execute("SELECT blog_id, COUNT(*) FROM keywords "+
+                    "WHERE blog_id != ? AND keywords IN (SELECT keywords FROM keywords WHERE blog_id = ?) "+
+                    "GROUP BY blog_id", (self.blog_id, self.blog_id))
+        return Blog.getManyFromDB(sampleTopByCount(cur.fetchall(), retreiveCount, rng), self.conn)
     
-    def getSimilarBlogsByTags(self, retreiveCount = 5, logKeywords = False):
+    def getSimilarBlogsByTags(self, retreiveCount = 5, logKeywords = False, rng = None, invertedIndex = None):
         '''
             Get a list of blogs with the same tags as this blog.
 
@@ -300,11 +347,13 @@ class Blog:
 
             retreiveCount   `None|int` - The topmost k comments, all if None is given.
             logKeywords     `bool`      - Whether to log the keywords found in this blog.
+            rng             `random.Random` - The random generator for tie-breaking. Default as the global random module.
+            invertedIndex   `InvertedIndex` - An index built from the tags table, used instead of the SQL query if given.
 
             Returns
             ====================================
 
-            `list(Blog)`  - a list of Blog objects.
+            `list(Blog)`  - a list of Blog objects, sorted by the number of matched tags.
 
         '''
         cur = self.conn.cursor()
@@ -314,19 +363,14 @@ class Blog:
             cur.execute("SELECT tags FROM tags WHERE blog_id = " + str(self.blog_id))
             print("Tags:\n", [r[0] for r in cur.fetchall()])
 
-        # Select a list of blogs.
-        cur.execute("SELECT * FROM blogs "+
-                    "WHERE blog_id IN "+
-                        "(SELECT blog_id "+
-                            # From a shuffled tags table.
-                            "FROM (SELECT * FROM tags ORDER BY RANDOM()) " +
-                            # The tags should be in those tags of this blog
-                            "WHERE blog_id != " + str(self.blog_id) +" AND tags IN (SELECT tags FROM tags WHERE blog_id = " + str(self.blog_id) + ") "+
-                            "GROUP BY blog_id "+
-                            "ORDER BY COUNT(tag_id) DESC" + 
-                            ("" if retreiveCount is None else (" LIMIT " + str(retreiveCount))) + 
-                        ") ")
-        return [Blog(*b, self.conn) for b in cur.fetchall()]
+        if invertedIndex is not None:
+            return Blog.getManyFromDB(invertedIndex.query(self.blog_id, retreiveCount, numpyRandom(rng)), self.conn)
+
+        # Count the matched tags of the candidate blogs, the tags should be in those tags of this blog
+        cur.execute("SELECT blog_id, COUNT(*) FROM tags "+
+                    "WHERE blog_id != ? AND tags IN (SELECT tags FROM tags WHERE blog_id = ?) "+
+                    "GROUP BY blog_id", (self.blog_id, self.blog_id))
+        return Blog.getManyFromDB(sampleTopByCount(cur.fetchall(), retreiveCount, rng), self.conn)
     
     def getCommentsFromSimilarKeywords(self, retreiveCount = 5):
         '''
@@ -370,7 +414,7 @@ class Blog:
         cur.execute("SELECT * FROM comments WHERE blog_id IN (" + ",".join([str(b.blog_id) for b in self.getSimilarBlogsByTags(retreiveCount)]) + ") ORDER BY RANDOM()" + ("" if retreiveCount is None else (" LIMIT " + str(retreiveCount))))
         return [Comment(*c) for c in cur.fetchall()]
     
-    def getSimilarBlogsByTFIDF(self, conn2 = sqlite3.connect(DB_FILE2), topK = 10, retreiveCount = 5, logKeywords = False, orderedBy = "count"):
+    def getSimilarBlogsByTFIDF(self, conn2 = sqlite3.connect(DB_FILE2), topK = 10, retreiveCount = 5, logKeywords = False, orderedBy = "count", rng = None, engine = None):
         '''
             Get a list of blogs with the similar TFIDF as this blog.
 
@@ -382,6 +426,8 @@ class Blog:
             retreiveCount   `None|int`  - The topmost k blogs, all if None is given.
             logKeywords     `bool`      - Whether to log the keywords found in this blog.
             orderedBy       `str`       - "count": blogs sorted by tf-idf matched vocab count; "tfidf": blogs sorted by tf-idf similarity
+            rng             `random.Random` - The random generator for tie-breaking. Default as the global random module.
+            engine          `TFIDFMatrix`   - A preloaded matrix of blogs_title_tf_idf for "tfidf", the candidate rows are loaded for each call if None is given.
 
             Returns
             ====================================
@@ -392,45 +438,24 @@ class Blog:
         cur = self.conn.cursor()
         cur2 = conn2.cursor()
 
-        
-        cur2.execute("SELECT word FROM word_dict WHERE id IN (SELECT word_id "+
-                        "FROM (SELECT word_id,tf_idf "+
-                            "FROM blogs_tf_idf "+
-                            "WHERE blog_id = " + str(self.blog_id) + " " +
-                            "ORDER BY RANDOM()) "+
-                        "ORDER BY tf_idf DESC "+
-                        "LIMIT " + str(topK) + ")")
+        # Select the top-K tf-idf words of this blog
+        cur2.execute("SELECT word_id, tf_idf FROM blogs_tf_idf WHERE blog_id = ?", (self.blog_id,))
+        wordIDs = sampleTopByCount(cur2.fetchall(), topK, rng)
+        cur2.execute("SELECT word FROM word_dict WHERE id IN (" + ",".join(["?"] * len(wordIDs)) + ")", wordIDs)
         tfidfKeywords = [r[0] for r in cur2.fetchall()]
 
         if (logKeywords):
             print("tf-idf Keywords:\n", tfidfKeywords)
 
-        # Select a list of blogs_id.
-        cur.execute("SELECT * FROM blogs "+
-                    "WHERE blog_id IN "+
-                        "(SELECT blog_id "+
-                            # From a shuffled keywords table.
-                            "FROM (SELECT * FROM keywords ORDER BY RANDOM()) " +
-                            # The keywords should be in those keywords of this blog
-                            "WHERE blog_id != " + str(self.blog_id) +" AND keywords IN ('" + "','".join(tfidfKeywords) + "') "+
-                            "GROUP BY blog_id "+
-                            "ORDER BY COUNT(keywords_id) DESC" + 
-                            ("" if retreiveCount is None else (" LIMIT " + str(retreiveCount))) + 
-                        ") ")
-        blogList = [Blog(*b, self.conn) for b in cur.fetchall()]
+        # Count the matched keywords of the candidate blogs, the keywords should be in the tf-idf words of this blog
+        cur.execute("SELECT blog_id, COUNT(*) FROM keywords "+
+                    "WHERE blog_id != ? AND keywords IN (" + ",".join(["?"] * len(tfidfKeywords)) + ") "+
+                    "GROUP BY blog_id", (self.blog_id, *tfidfKeywords))
+        blogList = Blog.getManyFromDB(sampleTopByCount(cur.fetchall(), retreiveCount, rng), self.conn)
 
         # Sort by tf-idf similarity
         if (orderedBy == "tfidf"):
-            cur2.execute("SELECT word_id FROM blogs_title_tf_idf GROUP BY word_id")
-            word_id_list = [r[0] for r in cur2.fetchall()]
-
-            cur2.execute("SELECT blog_id, word_id, tf_idf FROM blogs_title_tf_idf WHERE blog_id IN (" + ",".join([*[str(b.blog_id) for b in blogList],str(self.blog_id)]) + ")")
-            tf_idf_dict = {}
-            for r in cur2.fetchall():
-                if (r[0] not in tf_idf_dict):
-                    tf_idf_dict[r[0]] = {word_id: 0 for word_id in word_id_list}
-                tf_idf_dict[r[0]][r[1]] = r[2]
-            blogList = sorted(blogList, key=lambda blog: cosine_similarity([tf_idf_dict[self.blog_id]], tf_idf_dict[int(blog.blog_id)])[0][0])[:retreiveCount]
+            blogList = self.sortByTFIDF(blogList, engine or TFIDFMatrix.build(conn2, "blogs_title_tf_idf", [*[b.blog_id for b in blogList], self.blog_id]))[:retreiveCount]
         
         return blogList
 
@@ -457,7 +482,7 @@ class Blog:
         cur.execute("SELECT * FROM comments WHERE blog_id IN (" + ",".join([str(b.blog_id) for b in self.getSimilarBlogsByTFIDF(conn2, topK, retreiveCount)]) + ") ORDER BY RANDOM()" + ("" if retreiveCount is None else (" LIMIT " + str(retreiveCount))))
         return [Comment(*c) for c in cur.fetchall()]
     
-    def getSimilarBlogs(self, conn2 = sqlite3.connect(DB_FILE2), topK = 10, retreiveCount = 5, finalRetreiveCount = 1, logKeywords = False, cachedWordList = None, orderedBy = "random"):
+    def getSimilarBlogs(self, conn2 = sqlite3.connect(DB_FILE2), topK = 10, retreiveCount = 5, finalRetreiveCount = 1, logKeywords = False, cachedWordList = None, orderedBy = "random", rng = None, keywordIndex = None, tagIndex = None, engine = None):
         '''
             Get a list of blogs with the similar TFIDF as this blog.
 
@@ -469,7 +494,12 @@ class Blog:
             retreiveCount   `None|int`  - The topmost k blogs in each algorithm, all if None is given.
             finalRetreiveCount  `int`   - The topmost k blogs to return.
             logKeywords     `bool`      - Whether to log the keywords found in this blog.
+            cachedWordList  `list[int]` - Not used anymore, kept for compatibility.
             orderedBy       `str`       - "random": blogs sorted by random order; "tfidf": blogs sorted by tf-idf similarity
+            rng             `random.Random` - The random generator for tie-breaking. Default as the global random module.
+            keywordIndex    `InvertedIndex` - An index of the keywords table, see getSimilarBlogsByKeywords.
+            tagIndex        `InvertedIndex` - An index of the tags table, see getSimilarBlogsByTags.
+            engine          `TFIDFMatrix`   - A preloaded matrix of blogs_tf_idf for "tfidf", the candidate rows are loaded for each call if None is given.
 
             Returns
             ====================================
@@ -477,34 +507,36 @@ class Blog:
             `list(Comment)`  - a list of Comment objects.
 
         '''
-        blogsFromKeywords = self.getSimilarBlogsByKeywords(retreiveCount = retreiveCount , logKeywords=logKeywords)
-        blogsFromTags = self.getSimilarBlogsByTags(retreiveCount=retreiveCount , logKeywords=logKeywords)
-        blogsFromTIFID = self.getSimilarBlogsByTFIDF(retreiveCount=retreiveCount , topK=topK, logKeywords=logKeywords)
+        blogsFromKeywords = self.getSimilarBlogsByKeywords(retreiveCount = retreiveCount , logKeywords=logKeywords, rng=rng, invertedIndex=keywordIndex)
+        blogsFromTags = self.getSimilarBlogsByTags(retreiveCount=retreiveCount , logKeywords=logKeywords, rng=rng, invertedIndex=tagIndex)
+        blogsFromTIFID = self.getSimilarBlogsByTFIDF(conn2, retreiveCount=retreiveCount , topK=topK, logKeywords=logKeywords, rng=rng)
 
         blogList = [*blogsFromKeywords, *blogsFromTags, *blogsFromTIFID]
 
-        cur2 = conn2.cursor()
         # Sort by tf-idf similarity
         if (orderedBy == "tfidf"):
-            if (cachedWordList is not None):
-                word_id_list = cachedWordList
-            else:
-                cur2.execute("SELECT word_id FROM blogs_tf_idf GROUP BY word_id")
-                word_id_list = [r[0] for r in cur2.fetchall()]
-
-            cur2.execute("SELECT blog_id, word_id, tf_idf FROM blogs_tf_idf WHERE blog_id IN (" + ",".join([*[str(b.blog_id) for b in blogList], str(self.blog_id)]) +  ")")
-            tf_idf_dict = {}
-            for r in cur2.fetchall():
-                if (r[0] not in tf_idf_dict):
-                    tf_idf_dict[r[0]] = [0 for word_id in word_id_list]
-                tf_idf_dict[r[0]][word_id_list.index(r[1])] = r[2]
-            
-            if self.blog_id in tf_idf_dict:
-                blogList = sorted(blogList, key=lambda blog: cosine_similarity([tf_idf_dict[self.blog_id]], [tf_idf_dict[blog.blog_id]])[0][0] if blog.blog_id in tf_idf_dict else 0)
+            blogList = self.sortByTFIDF(blogList, engine or TFIDFMatrix.build(conn2, "blogs_tf_idf", [*[b.blog_id for b in blogList], self.blog_id]))
         
         return blogList[:finalRetreiveCount]
 
-    def getCommentsFromSimilarBlogs(self, conn2 = sqlite3.connect(DB_FILE2), topK = 10, retreiveCount = 5, orderedBy = "random", cachedWordList = None, logKeywords = False, printBlogTitles=False):
+    def sortByTFIDF(self, blogList, engine):
+        '''
+            Sort blogs by descending tf-idf cosine similarity to this blog.
+
+            Parameters
+            ====================================
+
+            blogList    `list(Blog)`    - The blogs to be sorted.
+            engine      `TFIDFMatrix`   - The tf-idf matrix containing this blog and the blogs to be sorted.
+
+            Returns
+            ====================================
+
+            `list(Blog)`  - The sorted list, unchanged if this blog has no tf-idf words.
+        '''
+        return [blogList[i] for i in engine.rank(self.blog_id, [b.blog_id for b in blogList])]
+
+    def getCommentsFromSimilarBlogs(self, conn2 = sqlite3.connect(DB_FILE2), topK = 10, retreiveCount = 5, orderedBy = "random", cachedWordList = None, logKeywords = False, printBlogTitles=False, engine = None):
         '''
             Get a list of comments with the same tfidf as this blog.
 
@@ -514,6 +546,7 @@ class Blog:
             conn2  `sqlite3.Connection` - A SQLite connection object for the word dictionary. Default as the a new connection to the global DB_FILE2 databse file.
             topK            `int`       - The top-K tf-idf words to be selected for comparisons.
             retreiveCount   `None|int` - The topmost k comments, all if None is given.
+            engine          `TFIDFMatrix`   - A preloaded matrix of blogs_tf_idf, see getSimilarBlogs.
 
             Returns
             ====================================
@@ -524,7 +557,7 @@ class Blog:
         cur = self.conn.cursor()
 
         # Select a list of comments.
-        similarBlogs = self.getSimilarBlogs(conn2, topK, retreiveCount, orderedBy=orderedBy, logKeywords=logKeywords, cachedWordList=cachedWordList)
+        similarBlogs = self.getSimilarBlogs(conn2, topK, retreiveCount, orderedBy=orderedBy, logKeywords=logKeywords, cachedWordList=cachedWordList, engine=engine)
 
         if (printBlogTitles):
             print([str(b.title) for b in similarBlogs])
@@ -550,6 +583,29 @@ class Blog:
         blogRow = getData(conn = conn, table = "blogs", id1 = blog_id)
         return Blog(blog_id, blogRow[1], blogRow[2], conn = conn)
     
+    @staticmethod
+    def getManyFromDB(blog_ids, conn = sqlite3.connect(DB_FILE)):
+        '''
+            Get a list of Blog objects from the database in the given order.
+
+            Parameters
+            ====================================
+
+            blog_ids    `list[int]` - The blog_ids to retrieve.
+            conn    `sqlite3.Connection` - A SQLite connection object. Default as the a new connection to the global DB_FILE databse file.
+
+            Returns
+            ====================================
+
+            `list(Blog)`  - a list of Blog objects, in the order of blog_ids.
+        '''
+        if len(blog_ids) == 0:
+            return []
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM blogs WHERE blog_id IN (" + ",".join([str(int(bi)) for bi in blog_ids]) + ")")
+        blogMap = {b[0]: Blog(*b, conn) for b in cur.fetchall()}
+        return [blogMap[bi] for bi in blog_ids if bi in blogMap]
+    
     @staticmethod
     def getBlogsWithNoComments(conn = sqlite3.connect(DB_FILE)):
         '''
@@ -863,14 +919,105 @@ class WordDict():
         '''
         return len(self.results)
 
-    def buildTFIDF(self):
+    def getMeta(self, key):
+        ''' Get a value stored in the word_dict_meta table.
+
+            Parameters
+            ====================================
+
+            key     `str`   - "blog_hwm": the last blog_id counted in the dictionary; "tfidf_hwm": the last blog_id in the tf-idf tables; "corpus_count": the number of documents counted.
+
+            Returns
+            ====================================
+
+            `None|int`  - The value, None if it has not been stored.
+        '''
+        cur2 = self.conn2.cursor()
+        cur2.execute("CREATE TABLE IF NOT EXISTS word_dict_meta (key TEXT, value INTEGER, PRIMARY KEY(key))")
+        cur2.execute("SELECT value FROM word_dict_meta WHERE key = ?", (key,))
+        row = cur2.fetchone()
+        return None if row is None else row[0]
+
+    def setMeta(self, key, value):
+        ''' Store a value into the word_dict_meta table, see getMeta.
+        '''
+        cur2 = self.conn2.cursor()
+        cur2.execute("CREATE TABLE IF NOT EXISTS word_dict_meta (key TEXT, value INTEGER, PRIMARY KEY(key))")
+        cur2.execute("INSERT OR REPLACE INTO word_dict_meta VALUES(?, ?)", (key, value))
+        self.conn2.commit()
+
+    def iterBlogChunks(self, chunkSize = 2000, minBlogID = None):
+        ''' Iterate the blogs and their comments by chunks of blog_id order.
+
+            Parameters
+            ====================================
+
+            chunkSize   `int`   - The number of blogs in each chunk.
+            minBlogID   `None|int`  - Only the blogs with a larger blog_id, all if None is given.
+
+            Returns
+            ====================================
+
+            `generator(tuple(list[tuple], list[tuple]))`  - (blog rows of (blog_id, title, body), comment rows of (blog_id, comment_id, comments)) of each chunk.
+        '''
+        cur = self.conn.cursor()
+        cur.execute("SELECT blog_id,title,body FROM blogs WHERE blog_id > ? ORDER BY blog_id" + ("" if self.rowLimit is None else (" LIMIT " + str(self.rowLimit))), (-1 if minBlogID is None else minBlogID,))
+        commentCur = self.conn.cursor()
+        while True:
+            blogs = cur.fetchmany(chunkSize)
+            if not blogs:
+                break
+            commentCur.execute("SELECT blog_id,comment_id,comments FROM comments WHERE blog_id BETWEEN ? AND ?", (blogs[0][0], blogs[-1][0]))
+            yield blogs, commentCur.fetchall()
+
+    def iterSegmentedChunks(self, workers = None, chunkSize = 2000, minBlogID = None):
+        ''' Iterate the blogs and their comments by chunks, with the titles, the bodies and the comments segmented in a process pool.
+
+            Parameters
+            ====================================
+
+            workers     `int`   - The number of worker processes for the segmentation, segment in the current process if 1 is given. Default as the cpu count.
+            chunkSize   `int`   - The number of blogs in each chunk.
+            minBlogID   `None|int`  - Only the blogs with a larger blog_id, all if None is given.
+
+            Returns
+            ====================================
+
+            `generator(tuple(list[tuple], list[tuple], list[list[str]]))`  - (blog rows, comment rows, segmented texts) of each chunk, the texts are the titles, then the bodies, then the comments.
+        '''
+        with Segmenter(self.segType, workers, cache = get_cache()) as segmenter:
+            for blogs, comments in self.iterBlogChunks(chunkSize, minBlogID):
+                texts = [b[1] for b in blogs] + [b[2] for b in blogs] + [c[2] for c in comments]
+                yield blogs, comments, segmenter.segment_many(texts)
+
+    def countWords(self, segmentedTexts, columnMap):
+        ''' Count the scoped words of the segmented texts into COO arrays.
+
+            Parameters
+            ====================================
+
+            segmentedTexts  `list[list[str]]`   - The segmented texts.
+            columnMap       `dict(str, int)`    - The column of each scoped word.
+
+            Returns
+            ====================================
+
+            `tuple(np.ndarray, np.ndarray, np.ndarray)`  - (text index, word column, count) of each distinct word of each text.
+        '''
+        cols = [[columnMap[w] for w in words if w in columnMap] for words in segmentedTexts]
+        docs = np.repeat(np.arange(len(cols), dtype=np.int64), [len(c) for c in cols])
+        cols = np.fromiter((c for cs in cols for c in cs), dtype=np.int64, count=len(docs))
+        keys, counts = np.unique(docs * len(columnMap) + cols, return_counts=True)
+        return keys // len(columnMap), keys % len(columnMap), counts
+
+    def createTFIDFTables(self):
         # Create new tf-idf tables
         cur2 = self.conn2.cursor()
         print("DB Initiation - Creating tf-idf tables")
         cur2.execute('''DROP TABLE IF EXISTS blogs_tf_idf''')
         cur2.execute('''DROP TABLE IF EXISTS blogs_title_tf_idf''')
         cur2.execute('''DROP TABLE IF EXISTS comments_tf_idf''')
-        self.conn2.commit()
+        setVersion(self.conn2, 0)
         cur2.execute('''CREATE TABLE blogs_tf_idf
                     (blog_id    INTEGER, 
                     word_id     INTEGER,
@@ -896,89 +1043,99 @@ class WordDict():
                     PRIMARY KEY(blog_id,comment_id,word_id),
                     FOREIGN KEY(word_id) REFERENCES word_dict(id))''')
         self.conn2.commit()
-        
+
+    def insertTFIDF(self, workers = None, chunkSize = 2000, minBlogID = None):
+        ''' Insert the tf-idf rows of the blog titles, the blog bodies and the comments with the currently scoped dictionary.
+            The texts are processed chunk by chunk, so the memory is bounded by the chunk size.
+
+            Parameters
+            ====================================
+
+            workers     `int`   - The number of worker processes for the segmentation, segment in the current process if 1 is given. Default as the cpu count.
+            chunkSize   `int`   - The number of blogs processed in each chunk.
+            minBlogID   `None|int`  - Only the blogs with a larger blog_id, all if None is given.
+
+            Returns
+            ====================================
+
+            `None|int`  - The last blog_id inserted, None if there is no blog.
+        '''
+        if self.results is None:
+            raise ValueError("Must cache results using setCacheResults before use.")
+
+        cur2 = self.conn2.cursor()
+        cur2.execute("PRAGMA synchronous=OFF")
+
+        # The scoped words are indexed by columns
+        columnMap = {w[0]: col for col, w in enumerate(self.results)}
+        wordIDs = np.array([w[1] for w in self.results], dtype=np.int64)
+        idfs = np.array([w[4] for w in self.results], dtype=np.float64)
 
         print("DB TFIDF Initialization - Loop Entries")
         cur = self.conn.cursor()
-        # Select the title and blog ids form all the blogs
-        allEntries = cur.execute("SELECT blog_id,title,body FROM blogs" + ("" if self.rowLimit is None else (" LIMIT " + str(self.rowLimit))))
-        blogsTFIDF = dict()
-        blogsTitleTFIDF = dict()
-        commentsTFIDF = dict()
+        cur.execute("SELECT COUNT(blog_id) FROM blogs WHERE blog_id > ?", (-1 if minBlogID is None else minBlogID,))
+        blogCount = cur.fetchone()[0] if self.rowLimit is None else self.rowLimit
         idx = 0
+        lastBlogID = None
+        for blogs, comments, segmented in self.iterSegmentedChunks(workers, chunkSize, minBlogID):
+            docs, cols, counts = self.countWords(segmented, columnMap)
+
+            # tf is normalized by the number of scoped words in the text, texts without valid words have no rows
+            lens = np.bincount(docs, weights = counts, minlength = len(segmented))
+            tfidfs = counts / lens[docs] * idfs[cols]
+            keys = [(b[0],) for b in blogs] * 2 + [(c[0], c[1]) for c in comments]
+
+            titleRows, blogRows, commentRows = [], [], []
+            for doc, word_id, count, tfidf in zip(docs.tolist(), wordIDs[cols].tolist(), counts.tolist(), tfidfs.tolist()):
+                (titleRows if doc < len(blogs) else blogRows if doc < 2 * len(blogs) else commentRows).append((*keys[doc], word_id, count, tfidf))
+            cur2.executemany("INSERT INTO blogs_title_tf_idf VALUES(?, ?, ?, ?)", titleRows)
+            cur2.executemany("INSERT INTO blogs_tf_idf VALUES(?, ?, ?, ?)", blogRows)
+            cur2.executemany("INSERT INTO comments_tf_idf VALUES(?, ?, ?, ?, ?)", commentRows)
+            self.conn2.commit()
 
-        # Loop all the blogs for tf-idf preparation
-        blogCount = Blog.getCount(self.conn) if self.rowLimit is None else self.rowLimit
-        for i in allEntries:
-            # Segment the title and push into the counter
-            allWordsTitle = self.transformTextToIDs(i[1])
-            titleCounter = collections.Counter(allWordsTitle)
-            eleLen = sum(titleCounter.values())
-            # There may be cases with no valid words found
-            if (eleLen > 0):
-                blogsTitleTFIDF[i[0]] = {w[1]: (ctn, ctn/eleLen*w[4]) for w,ctn in titleCounter.items()}
-           
-            # Segment the body and push into the counter
-            allWordsBody = self.transformTextToIDs(i[2])
-            bodyCounter = collections.Counter(allWordsBody)
-            eleLen = sum(bodyCounter.values())
-            # There may be cases with no valid words found
-            if (eleLen > 0):
-                blogsTFIDF[i[0]] = {w[1]: (ctn, ctn/eleLen*w[4]) for w,ctn in bodyCounter.items()}
-
-            # Get the comments and push all the words
-            comments = Comment.getFromDB(i[0])
-            commentsTFIDF[i[0]] = dict()
-            for c in comments:
-                allWordsComment = self.transformTextToIDs(c.body)
-                commentCounter = collections.Counter(allWordsComment)
-                eleLen = sum(commentCounter.values())
-                # There may be cases with no valid words found
-                if (eleLen > 0):
-                    commentsTFIDF[i[0]][c.comment_id] = {w[1]: (ctn, ctn/eleLen*w[4]) for w,ctn in commentCounter.items()}
-
-            # Log progresses
-            idx+=1
-            if (idx % 500 == 0):
-                print("Processing... (", idx/blogCount*100, " %)")
-        
-        # Loop all the data and insert into the db
-        titleTFIDFLen = len(blogsTitleTFIDF)
-        idx = 0
-        for blog_id,titleWords in blogsTitleTFIDF.items():
-            for word_id,titleTfidf in titleWords.items():
-                cur2.execute("INSERT INTO blogs_title_tf_idf VALUES(" + str(blog_id) + ", " + str(word_id) + ", " + str(titleTfidf[0]) + ", " + str(titleTfidf[1]) + ")")
-            
             # Log progresses
-            idx += 1
-            if (idx % 500 == 0):
-                print("Processing - Blog Titles ... (", idx/titleTFIDFLen*100, " %)")
-        
-        # Loop all the data and insert into the db
-        blogTFIDFLen = len(blogsTFIDF)
-        idx = 0
-        for blog_id,blogWords in blogsTFIDF.items():
-            for word_id,blogTfidf in blogWords.items():
-                cur2.execute("INSERT INTO blogs_tf_idf VALUES(" + str(blog_id) + ", " + str(word_id) + ", " + str(blogTfidf[0]) + ", " + str(blogTfidf[1]) + ")")
-            
-            # Log progresses
-            idx += 1
-            if (idx % 500 == 0):
-                print("Processing - Blogs ... (", idx/blogTFIDFLen*100, " %)")
-        
-        # Loop all the comments and insert into the db
-        commentTFIDFLen = len(commentsTFIDF)
-        idx = 0
-        for blog_id,comments in commentsTFIDF.items():
-            for comment_id,commentWords in comments.items():
-                for word_id,commentTfidf in commentWords.items():
-                    cur2.execute("INSERT INTO comments_tf_idf VALUES(" + str(blog_id) + ", " + str(comment_id) + ", " + str(word_id) + ", " + str(commentTfidf[0]) + ", " + str(commentTfidf[1]) + ")")
-            # Log progresses
-            idx += 1
-            if (idx % 500 == 0):
-                print("Processing - Comments ... (", idx/commentTFIDFLen*100, " %)")
-        
-        self.conn2.commit()
+            idx += len(blogs)
+            lastBlogID = blogs[-1][0]
+            print("Processing... (", idx/max(blogCount, 1)*100, " %)")
+        cur2.execute("PRAGMA synchronous=FULL")
+        return lastBlogID
+
+    def buildTFIDF(self, workers = None, chunkSize = 2000):
+        ''' Build the tf-idf tables of the blog titles, the blog bodies and the comments with the currently scoped dictionary.
+            The texts are segmented in a process pool chunk by chunk, so the memory is bounded by the chunk size.
+
+            Parameters
+            ====================================
+
+            workers     `int`   - The number of worker processes for the segmentation, segment in the current process if 1 is given. Default as the cpu count.
+            chunkSize   `int`   - The number of blogs processed in each chunk.
+        '''
+        if self.results is None:
+            raise ValueError("Must cache results using setCacheResults before use.")
+
+        self.createTFIDFTables()
+        lastBlogID = self.insertTFIDF(workers, chunkSize)
+        self.setMeta("tfidf_hwm", lastBlogID)
+
+        # Create the indexes after the insertion
+        migrate(self.conn2, "wordDict")
+
+    def updateTFIDF(self, workers = None, chunkSize = 2000):
+        ''' Insert the tf-idf rows of the blogs newer than the last buildTFIDF/updateTFIDF with the currently scoped dictionary.
+            The rows of the older blogs are kept, they are re-weighted by WordDict.update when the idf changes.
+
+            Parameters
+            ====================================
+
+            workers     `int`   - The number of worker processes for the segmentation, segment in the current process if 1 is given. Default as the cpu count.
+            chunkSize   `int`   - The number of blogs processed in each chunk.
+        '''
+        tfidfHWM = self.getMeta("tfidf_hwm")
+        if tfidfHWM is None:
+            raise ValueError("No tf-idf high-water mark found, build the tables using buildTFIDF first.")
+        lastBlogID = self.insertTFIDF(workers, chunkSize, minBlogID = tfidfHWM)
+        if lastBlogID is not None:
+            self.setMeta("tfidf_hwm", lastBlogID)
 
     @staticmethod
     def getWordList(conn2 = sqlite3.connect(DB_FILE2)):
@@ -1000,11 +1157,11 @@ class WordDict():
 
             `str`   - The string withought numbers, emails, URLs.
         '''
-        return re.sub("\r|[0-9.]+|([-a-zA-Z0-9.`?{}]+@\w+\.\w+)|(((http|https):\/\/[\w\-_]+(\.[\w\-_]+)+([\w\-\.,@?^=%&amp;:/~\+#]*[\w\-\@?^=%&amp;/~\+#])?)?)", "",string)
+        return remove_invalid(string)
 
     @staticmethod
     def segment(text, segType = 2):
-        ''' Segment the incoming text into Chinese and English words.
+        ''' Segment the incoming text into Chinese and English words, looked up in the segmentation cache first.
 
             Parameters
             ====================================
@@ -1017,42 +1174,10 @@ class WordDict():
 
             `list[str]`   - Segmented text in a list.
         '''
-        # Decompose HTML if needed
-        if (re.search("<.+>", text)):
-            text = re.sub("\n+", "\n", "".join([s for s in BeautifulSoup(text, "html.parser").find_all(string=True) if (s.parent.name not in ["script", "style", "select", "option"] and not isinstance(s, Comment))]))
-        
-        # Skip English and Numbers if needed
-        if (segType == 1):
-            text = re.sub("[0-9a-zA-Z]","",text)
-
-        # Split all the characters
-        if (segType == 2):
-            words = [*jieba.cut(text, cut_all=False)]
-
-        # OR use jieba to perform word segmentation
-        elif (segType == 0 or segType == 1):
-            words = [*WordDict.removeInvalid(text)]
-
-            # Replace the split english characters with a grouped word
-            if (len(words) > 1):
-                startEng = [*filter(lambda c: re.match("[a-zA-Z\']",c[1]) and (c[0]==0 or re.match("[a-zA-Z]",words[c[0]-1]) is None), enumerate(words))]
-                endEng = [*filter(lambda c: re.match("[a-zA-Z\']",c[1]) and (c[0]==(len(words)-1) or re.match("[a-zA-Z]",words[c[0]+1]) is None), enumerate(words))]
-            else:
-                startEng = []
-                endEng = []
-            replaceEle = zip([s[0] for s in startEng], [e[0]+1 for e in endEng])
-            accLen = 0
-            for r in replaceEle:
-                start = r[0] - accLen
-                end = r[1] - accLen
-                words[start] = "".join(words[start:end])
-                words[start+1:] = words[end:]
-                accLen += end-start-1
-        
-        return words
+        return get_segmenter(segType).segment(text)
 
     @staticmethod
-    def build(conn = sqlite3.connect(DB_FILE), conn2 = sqlite3.connect(DB_FILE2), rowLimit = None, segType = 2):
+    def build(conn = sqlite3.connect(DB_FILE), conn2 = sqlite3.connect(DB_FILE2), rowLimit = None, segType = 2, workers = None, chunkSize = 2000):
         ''' Build the dictionary of all the Chinese words and English words.
 
             Parameters
@@ -1062,6 +1187,8 @@ class WordDict():
             conn2    `sqlite3.Connection`   - A SQLite connection object for the word dictionary. Default as the a new connection to the global DB_FILE2 databse file.
             rowLimit    `int`               - The limit row count of blogs to return.
             segType     `int`               - 0: by characters; 1: by characters, but remove english words; 2: by jieba
+            workers     `int`               - The number of worker processes for the segmentation, segment in the current process if 1 is given. Default as the cpu count.
+            chunkSize   `int`               - The number of blogs processed in each chunk.
 
             Returns
             ====================================
@@ -1085,7 +1212,8 @@ class WordDict():
         cur2.execute('''DROP TABLE IF EXISTS blogs_tf_idf''')
         cur2.execute('''DROP TABLE IF EXISTS blogs_title_tf_idf''')
         cur2.execute('''DROP TABLE IF EXISTS comments_tf_idf''')
-        conn2.commit()
+        cur2.execute('''DROP TABLE IF EXISTS word_dict_meta''')
+        setVersion(conn2, 0)
         cur2.execute('''CREATE TABLE word_dict
                     (word    TEXT, 
                     id       INTEGER,
@@ -1099,39 +1227,22 @@ class WordDict():
 
 
         print("DB Initiation - Loop Entries")
-        # Select the title and blog ids form all the blogs
-        allEntries = cur.execute("SELECT blog_id,title,body FROM blogs" + ("" if rowLimit is None else (" LIMIT " + str(rowLimit))))
-        wordCount = dict()
+        wordCount = collections.Counter()
         idx = 0
+        blogHWM = None
         wordDict.initalCorpusCount()
         corpusCount = wordDict.corpusCount
 
-        # Loop all the blogs for dictionary preparation
-        for i in allEntries:
-            # Segment the title and push into the counter
-            allWordsTitle = WordDict.segment(i[1], segType = segType)
-            wordsTitle = set(allWordsTitle)
-            for w in wordsTitle:
-                wordCount[w] = wordCount.setdefault(w, 0) + 1
-            
-            # Segment the body and push into the counter
-            allWordsBody = WordDict.segment(i[2], segType = segType)
-            wordsBody = set(allWordsBody)
-            for w in wordsBody:
-                wordCount[w] = wordCount.setdefault(w, 0) + 1
-
-            # Get the comments and push all the words
-            comments = Comment.getFromDB(i[0])
-            for c in comments:
-                allWordsComment = WordDict.segment(c.body, segType = segType)
-                wordsComment = set(allWordsComment)
-                for w in wordsComment:
-                    wordCount[w] = wordCount.setdefault(w, 0) + 1
+        # Loop all the blogs by chunks, the titles, the bodies and the comments are segmented in a process pool
+        for blogs, comments, segmented in wordDict.iterSegmentedChunks(workers, chunkSize):
+            # Each title, body and comment counts once per word
+            for words in segmented:
+                wordCount.update(set(words))
 
             # Log progresses
-            idx+=1
-            if (idx % 500 == 0):
-                print("Processing... (", idx/blogCount*100, " %)")
+            idx += len(blogs)
+            blogHWM = blogs[-1][0]
+            print("Processing... (", idx/max(blogCount, 1)*100, " %)")
 
         # Loop all the words and insert into the db
         wordCountLen = len(wordCount);
@@ -1143,6 +1254,94 @@ class WordDict():
         
         conn2.commit()
 
+        # Keep the high-water mark for the incremental updates
+        wordDict.setMeta("blog_hwm", blogHWM)
+        wordDict.setMeta("corpus_count", corpusCount)
+
+        return wordDict
+
+    @staticmethod
+    def update(conn = sqlite3.connect(DB_FILE), conn2 = sqlite3.connect(DB_FILE2), segType = 2, workers = None, chunkSize = 2000):
+        ''' Update the dictionary with the blogs newer than the last build/update, instead of rebuilding it from scratch.
+            The document frequencies are updated with the new blogs only, then the idf of all the words is recomputed,
+            and the existing tf-idf rows are re-weighted in place by the ratio of the new idf to the old idf.
+            Use updateTFIDF afterwards to add the tf-idf rows of the new blogs.
+
+            Parameters
+            ====================================
+
+            conn    `sqlite3.Connection`    - A SQLite connection object for the data source. Default as the a new connection to the global DB_FILE databse file.
+            conn2    `sqlite3.Connection`   - A SQLite connection object for the word dictionary. Default as the a new connection to the global DB_FILE2 databse file.
+            segType     `int`               - 0: by characters; 1: by characters, but remove english words; 2: by jieba. It should be the same as the one used to build.
+            workers     `int`               - The number of worker processes for the segmentation, segment in the current process if 1 is given. Default as the cpu count.
+            chunkSize   `int`               - The number of blogs processed in each chunk.
+
+            Returns
+            ====================================
+
+            `WordDict - A dictionary object for the connection of the updated dictionary.
+        '''
+        wordDict = WordDict(conn, conn2, segType=segType)
+        blogHWM = wordDict.getMeta("blog_hwm")
+        corpusCount = wordDict.getMeta("corpus_count")
+        if blogHWM is None or corpusCount is None:
+            raise ValueError("No high-water mark found, build the dictionary using WordDict.build first.")
+
+        print("DB Update - Loop Entries after blog_id " + str(blogHWM))
+        wordCount = collections.Counter()
+        newDocCount = 0
+        for blogs, comments, segmented in wordDict.iterSegmentedChunks(workers, chunkSize, minBlogID = blogHWM):
+            # Each title, body and comment is a document
+            for words in segmented:
+                wordCount.update(set(words))
+            newDocCount += len(segmented)
+            blogHWM = blogs[-1][0]
+            print("Processing... (blog_id ", blogHWM, ")")
+
+        if newDocCount == 0:
+            print("DB Update - No new blogs")
+            wordDict.corpusCount = corpusCount
+            return wordDict
+
+        cur2 = conn2.cursor()
+        cur2.execute("SELECT word, id, idf FROM word_dict")
+        existing = {w: (wid, idf) for w, wid, idf in cur2.fetchall()}
+        nextID = max([v[0] for v in existing.values()], default = -1) + 1
+
+        # Keep the old idf to re-weight the tf-idf rows afterwards
+        cur2.execute("DROP TABLE IF EXISTS temp.old_idf")
+        cur2.execute("CREATE TEMP TABLE old_idf (word_id INTEGER, idf FLOAT, PRIMARY KEY(word_id))")
+        cur2.executemany("INSERT INTO temp.old_idf VALUES(?, ?)", existing.values())
+
+        print("DB Update - Updating " + str(len(wordCount)) + " words")
+        cur2.executemany("UPDATE word_dict SET count = count + ? WHERE id = ?", [(c, existing[w][0]) for w, c in wordCount.items() if w in existing])
+        newWords = [w for w in wordCount if w not in existing]
+        cur2.executemany("INSERT INTO word_dict VALUES(?, ?, ?, 0, 0)", [(w, nextID + idx, wordCount[w]) for idx, w in enumerate(newWords)])
+
+        # The corpus count changes the idf of every word
+        corpusCount += newDocCount
+        conn2.create_function("PY_LOG", 1, math.log)
+        cur2.execute("UPDATE word_dict SET freq = count * 1.0 / ?, idf = PY_LOG(? * 1.0 / count)", (corpusCount, corpusCount))
+
+        # Every idf changes with the corpus count, so re-weight the existing tf-idf rows by new idf / old idf in place.
+        # The rows of an old idf 0 (a word in every document) have no weight to recover and are kept.
+        cur2.execute("DROP TABLE IF EXISTS temp.idf_ratio")
+        cur2.execute('''CREATE TEMP TABLE idf_ratio AS
+                    SELECT o.word_id AS word_id, w.idf / o.idf AS ratio FROM temp.old_idf o
+                    JOIN word_dict w ON w.id = o.word_id
+                    WHERE o.idf != 0 AND w.idf != o.idf''')
+        cur2.execute("CREATE INDEX temp.idx_idf_ratio ON idf_ratio(word_id)")
+        cur2.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('blogs_tf_idf', 'blogs_title_tf_idf', 'comments_tf_idf')")
+        for (table,) in cur2.fetchall():
+            print("DB Update - Re-weighting " + table)
+            cur2.execute("UPDATE " + table + " SET tf_idf = tf_idf * (SELECT ratio FROM temp.idf_ratio r WHERE r.word_id = " + table + ".word_id) WHERE word_id IN (SELECT word_id FROM temp.idf_ratio)")
+        cur2.execute("DROP TABLE temp.old_idf")
+        cur2.execute("DROP TABLE temp.idf_ratio")
+        conn2.commit()
+
+        wordDict.setMeta("blog_hwm", blogHWM)
+        wordDict.setMeta("corpus_count", corpusCount)
+        wordDict.corpusCount = corpusCount
         return wordDict
 
 
@@ -1156,41 +1355,42 @@ class WordDict():
 '''
     Test of getting comments from a blog_id 2
 '''
-connection = sqlite3.connect(DB_FILE)
-connection2 = sqlite3.connect(DB_FILE2)
-
-wordList = WordDict.getWordList(connection2)
-
-for i in range(0,10):
-    # Get a blog from blog_id
-    testBlog = Blog.getFromDB(int(random.random()*200000), conn = connection)
-    print("Blog ID: ", testBlog.blog_id)
-    print("Blog Title: ", testBlog.title)
-    print("Keywords:\n", [k.keyword for k in testBlog.getThisKeywords()])
+if __name__ == "__main__":
+    connection = sqlite3.connect(DB_FILE)
+    connection2 = sqlite3.connect(DB_FILE2)
+
+    wordList = WordDict.getWordList(connection2)
+
+    for i in range(0,10):
+        # Get a blog from blog_id
+        testBlog = Blog.getFromDB(int(random.random()*200000), conn = connection)
+        print("Blog ID: ", testBlog.blog_id)
+        print("Blog Title: ", testBlog.title)
+        print("Keywords:\n", [k.keyword for k in testBlog.getThisKeywords()])
     
-    # Get comments in this post
-    nowComments = testBlog.getThisComments()
-    print("\nComments in this post:\n", *[c.body for c in nowComments])
-
-    # Get random comments in other posts
-    #nowComments = testBlog.getOtherComments(retreiveCount=5)
-    #print("Comments in other post:\n", [c.body for c in nowComments])
-
-    # Get similar blogs
-    #print("\nSimilar Blog (Keywords):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogsByKeywords(logKeywords=True)])
-    #print("\nSimilar Blog (Tags):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogsByTags(logKeywords=True)])
-    #print("\nSimilar Blogs (TFIDF):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogsByTFIDF(connection2, logKeywords=True)])
-    #print("\nSimilar Blog (Overall):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogs(logKeywords=True, orderedBy="tfidf")])
+        # Get comments in this post
+        nowComments = testBlog.getThisComments()
+        print("\nComments in this post:\n", *[c.body for c in nowComments])
+
+        # Get random comments in other posts
+        #nowComments = testBlog.getOtherComments(retreiveCount=5)
+        #print("Comments in other post:\n", [c.body for c in nowComments])
+
+        # Get similar blogs
+        #print("\nSimilar Blog (Keywords):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogsByKeywords(logKeywords=True)])
+        #print("\nSimilar Blog (Tags):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogsByTags(logKeywords=True)])
+        #print("\nSimilar Blogs (TFIDF):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogsByTFIDF(connection2, logKeywords=True)])
+        #print("\nSimilar Blog (Overall):\n", *[(b.blog_id, b.title) for b in testBlog.getSimilarBlogs(logKeywords=True, orderedBy="tfidf")])
     
-    # Get similar comments
-    #print("\nOriginal Comments (Keywords):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarKeywords(retreiveCount=10)])
-    #print("\nOriginal Comments (Tags):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarTags(retreiveCount=10)])
-    #print("\nOriginal Comments (TFIDF):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarTFIDF(retreiveCount=10)])
-    print("\nOriginal Comments (Overall):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarBlogs(retreiveCount=10, orderedBy="tfidf", printBlogTitles = True, logKeywords = True, cachedWordList=wordList)])
+        # Get similar comments
+        #print("\nOriginal Comments (Keywords):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarKeywords(retreiveCount=10)])
+        #print("\nOriginal Comments (Tags):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarTags(retreiveCount=10)])
+        #print("\nOriginal Comments (TFIDF):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarTFIDF(retreiveCount=10)])
+        print("\nOriginal Comments (Overall):\n", *[(c.blog_id, c.body) for c in testBlog.getThisComments()], "\nSimilar Comments:\n", [c.body for c in testBlog.getCommentsFromSimilarBlogs(retreiveCount=10, orderedBy="tfidf", printBlogTitles = True, logKeywords = True, cachedWordList=wordList)])
     
-    # Get the count of blogs with no comments
-    # print(Blog.getBlogsWithNoComments(connection))
-    print("\n\n")
+        # Get the count of blogs with no comments
+        # print(Blog.getBlogsWithNoComments(connection))
+        print("\n\n")
 
 '''
 # Build word dict initially
@@ -1215,4 +1415,15 @@ wordDict.buildTFIDF()
 
 # Sample the first 500 records to check it
 #print("Sample of Rows: \n", wordDict.results[:500])
+'''
+
+'''
+# Update the word dict with the newly appended blogs only
+wordDict = WordDict.update()
+
+# Keep the same scope as the built tf-idf tables
+wordDict.getRowsByFreq()
+wordDict.keepChineseOnly()
+
+wordDict.updateTFIDF()
 '''
\ No newline at end of file
@@ -0,0 +1,127 @@
+import os,time,argparse
+import numpy as np
+import torch
+from data import DataLoader,collate_tokens
+from match import PIXNETNET
+from ann import IVFIndex
+
+# the batches as index arrays of the rows, in the order of the batchers
+def batch_indices(batcher):
+    indices = []
+    while True:
+        idx = batcher.indexer.next_batch_indices()
+        if idx is None:
+            batcher.rewind()
+            return indices
+        indices.append(idx)
+
+# the old collation: each field sorted by its own length, so the rows of the fields do not match
+def collate_sorted(batcher,idx):
+    padded,lens = collate_tokens(batcher.tokens,batcher.offsets,idx)
+    sorted_idx = np.argsort(-lens,kind='stable')
+    return (torch.from_numpy(padded[sorted_idx]),torch.from_numpy(lens[sorted_idx])),sorted_idx
+
+# the joint collation: all the fields in the order of the batch
+def collate_joint(batcher,idx):
+    padded,lens = collate_tokens(batcher.tokens,batcher.offsets,idx)
+    return (torch.from_numpy(padded),torch.from_numpy(lens)),None
+
+def run(collate,batch_title,batch_comment,indices,model=None):
+    start = time.perf_counter()
+    mismatched,rows = 0,0
+    for idx in indices:
+        title,title_order = collate(batch_title,idx)
+        comment,comment_order = collate(batch_comment,idx)
+        if title_order is not None:
+            mismatched += int((title_order != comment_order).sum())
+        rows += len(idx)
+        if model is not None:
+            with torch.no_grad():
+                model(title,comment)
+    return time.perf_counter()-start,mismatched/rows
+
+def benchmark_collate(path,batch_size,bucket,repeat,forward):
+    loader = DataLoader()
+    loader.load_all(path,batch_size,bucket)
+    _,batch_title,batch_comment = loader.batch_data
+    indices = batch_indices(batch_title)
+    model = PIXNETNET(loader.vocab,200,128,256).eval() if forward else None
+
+    print('%d batches of %d rows, bucket=%s, forward=%s'%(len(indices),batch_size,bucket,forward))
+    for name,collate in [('per-field sort',collate_sorted),('joint',collate_joint)]:
+        seconds = min(run(collate,batch_title,batch_comment,indices,model)[0] for _ in range(repeat))
+        mismatch = run(collate,batch_title,batch_comment,indices)[1]
+        print('%-15s %.3fs  %.0f rows/s  mismatched title/comment rows %.1f%%'%(name,seconds,len(indices)*batch_size/seconds,mismatch*100))
+
+# clustered gaussian vectors standing in for the comment embeddings
+def synthetic_vectors(N,dim,clusters,rng):
+    centers = rng.normal(size=(clusters,dim)).astype(np.float32)
+    return centers[rng.integers(clusters,size=N)]+0.5*rng.normal(size=(N,dim)).astype(np.float32)
+
+def exact_search(vectors,queries,k):
+    scores = queries@np.asarray(vectors,dtype=np.float32).T
+    top = np.argpartition(-scores,k-1,axis=1)[:,:k]
+    return np.take_along_axis(top,np.argsort(-np.take_along_axis(scores,top,1),axis=1,kind='stable'),1)
+
+# the share of the exact top k found in the approximate top k
+def recall_at_k(exact_ids,ann_ids):
+    return np.mean([len(np.intersect1d(e,a))/len(e) for e,a in zip(exact_ids,ann_ids)])
+
+# bank_dir: the embeddings of retrieval.build_comment_bank, synthetic vectors if None
+def benchmark_ann(bank_dir,N,dim,query_num,k,nlist,pq_ms,nprobes):
+    rng = np.random.default_rng(0)
+    if bank_dir is None:
+        vectors = synthetic_vectors(N,dim,max(1,N//1000),rng)
+        queries = synthetic_vectors(query_num,dim,max(1,N//1000),np.random.default_rng(1))
+    else:
+        vectors = np.load(os.path.join(bank_dir,'embeddings.npy'),mmap_mode='r')
+        queries = np.asarray(vectors[rng.choice(len(vectors),query_num,replace=False)],dtype=np.float32)
+    queries = queries+0.1*rng.normal(size=queries.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    exact_ids = exact_search(vectors,queries,k)
+    exact_seconds = time.perf_counter()-start
+    print('%d vectors of %d dims, %d queries, exact top %d: %.2fms/query'%(len(vectors),vectors.shape[1],query_num,k,exact_seconds*1000/query_num))
+
+    for pq_m in pq_ms:
+        start = time.perf_counter()
+        index = IVFIndex.build(vectors,nlist,pq_m)
+        print('IVF nlist=%d pq_m=%d built in %.1fs'%(index.nlist(),pq_m,time.perf_counter()-start))
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            ids,_ = index.search(queries,k,nprobe)
+            seconds = time.perf_counter()-start
+            print('  nprobe=%-4d recall@%d %.3f  %.2fms/query'%(nprobe,k,recall_at_k(exact_ids,ids),seconds*1000/query_num))
+            if pq_m > 0:
+                start = time.perf_counter()
+                ids,_ = index.search(queries,k,nprobe,rerank_vectors=vectors)
+                seconds = time.perf_counter()-start
+                print('  nprobe=%-4d recall@%d %.3f  %.2fms/query  re-ranked'%(nprobe,k,recall_at_k(exact_ids,ids),seconds*1000/query_num))
+
+def parse():
+    parser = argparse.ArgumentParser(description='PIXNET benchmarks')
+    parser.add_argument('mode',help='collate or ann')
+    parser.add_argument('-tp','--train_path',default='test_10000.txt')
+    parser.add_argument('-bs','--batch_size',default=64,type=int)
+    parser.add_argument('-n','--repeat',default=3,type=int)
+    parser.add_argument('--bucket',action='store_true')
+    # also run the model on the batches
+    parser.add_argument('--forward',action='store_true')
+
+    # for ann: the comment bank to search, synthetic vectors of -N rows if it is not given
+    parser.add_argument('-b','--bank_dir',default=None)
+    parser.add_argument('-N','--vector_num',default=100000,type=int)
+    parser.add_argument('--dim',default=128,type=int)
+    parser.add_argument('-q','--query_num',default=200,type=int)
+    parser.add_argument('-k','--k',default=10,type=int)
+    parser.add_argument('--nlist',default=None,type=int)
+    parser.add_argument('--pq_m',default=[0,16],type=int,nargs='+')
+    parser.add_argument('--nprobe',default=[1,4,16,64],type=int,nargs='+')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arg = parse()
+    if arg.mode == 'collate':
+        benchmark_collate(arg.train_path,arg.batch_size,arg.bucket,arg.repeat,arg.forward)
+    elif arg.mode == 'ann':
+        benchmark_ann(arg.bank_dir,arg.vector_num,arg.dim,arg.query_num,arg.k,arg.nlist,arg.pq_m,arg.nprobe)
@@ -1,23 +1,37 @@
-import re,jieba,sqlite3,torch
+import os,re,json,queue,random,shutil,sqlite3,threading,torch
+import pickle as pkl
+from multiprocessing import Pool
 from db_api import Blog
 import numpy as np
 from config import get_device
+from segmenter import get_segmenter,trim_illegal_char
+from negativeSampler import NegativeSampler
 
 
 device = get_device()
 
 DB_FILE = "pixnet.db"
-
-def trim_illegal_char(text):
-    res = re.findall(r'[\u4e00-\u9fffa-zA-Z0-9 \t]+',text)
-    trimmed = "".join(res)
-    return trimmed
+SEGMENT_BATCH_SIZE = 2000
+WRITE_BUFFER_SIZE = 1024*1024
+FLUSH_EVERY = 20000
+SHARD_BLOGS = 2000
+COMPILE_CHUNK_ROWS = 10000
+RECORD_CHUNK_ROWS = 10000
+BUCKET_CHUNK_BATCHES = 50
+PREFETCH_BATCHES = 4
+
+# seg_type 3 of segmenter: jieba on the trimmed text
+SEG_TYPE = 3
 
 def preprocessing_blog_text(text):
-    seg_list = jieba.cut( trim_illegal_char(text),cut_all=False)
+    seg_list = get_segmenter(SEG_TYPE).segment(text)
     s = " ".join(seg_list)
     return s
 
+# segment a batch of texts in the shared segmenter pool, in order
+def preprocessing_blog_texts(texts):
+    return [" ".join(seg_list) for seg_list in get_segmenter(SEG_TYPE).segment_many(texts)]
+
     
 class Example():
     def __init__(self,blog,comment,label):
@@ -25,61 +39,146 @@ class Example():
         self.comment = comment
         self.label = label
     
-    def to_dataline(self):
+    # blog_title/comment_body: already segmented texts, eg. by preprocessing_blog_texts
+    def to_dataline(self,blog_title=None,comment_body=None):
         #assert self.blog.blog_id == self.comment.blog_id
 
         label = self.label
 
         blog_id = self.blog.blog_id
-        blog_title = preprocessing_blog_text(self.blog.title)
+        if blog_title is None:
+            blog_title = preprocessing_blog_text(self.blog.title)
         
         
         comment_id = self.comment.comment_id 
-        comment_body = preprocessing_blog_text(self.comment.body)
+        if comment_body is None:
+            comment_body = preprocessing_blog_text(self.comment.body)
 
-        line = '%d,%d,%d,%s,%s'%(label,blog_id,comment_id,blog_title,comment_body)
+        line = to_record(label,blog_id,comment_id,blog_title,comment_body)
         return line
 
 
 
 
+def batch_examples(examples,batch_size):
+    batch = []
+    for example in examples:
+        batch.append(example)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# segment the titles and the comments of a batch together, then write the lines
+def write_examples(f,examples):
+    titles = preprocessing_blog_texts([example.blog.title for example in examples])
+    bodies = preprocessing_blog_texts([example.comment.body for example in examples])
+    f.write("".join([example.to_dataline(title,body)+"\n" for example,title,body in zip(examples,titles,bodies)]))
+
+
+def connect_readonly(db_path):
+    return sqlite3.connect('file:%s?mode=ro'%(db_path),uri=True)
+
+# worker of generate_examples_sharded, one shard is the blogs in [start_blog_id,end_blog_id)
+def generate_shard(args):
+    db_path,save_path,start_blog_id,end_blog_id,seed,sampler_dir = args
+    conn = connect_readonly(db_path)
+    sampler = NegativeSampler.load(sampler_dir) if sampler_dir is not None else None
+    # the rng only depends on the seed and the shard, not on the worker running it
+    maker = DatasetGenerator(conn,rng=random.Random('%d:%d'%(seed,start_blog_id)),sampler=sampler)
+    example_cnt = maker.generate_examples(save_path,None,start_blog_id,end_blog_id)
+    conn.close()
+    return example_cnt
+
+
 class DatasetGenerator():
-    def __init__(self,conn):
+    # rng: random.Random for reproducible negative sampling, ORDER BY RANDOM() if None
+    # sampler: NegativeSampler with the comment keys loaded once, instead of the random SQL of each blog
+    def __init__(self,conn,rng=None,sampler=None):
         self.conn = conn
+        self.rng = rng
+        self.sampler = sampler
 
 
     # 產生 大約 example num筆的example 一個example是一行
-    def generate_examples(self,save_path,example_num=50000):
+    # examples are segmented and written batch by batch, the memory does not grow with example_num
+    def generate_examples(self,save_path,example_num=50000,start_blog_id=1,end_blog_id=None,flush_every=FLUSH_EVERY):
         example_cnt = 0
-        current_blog_id = 1
-        
-        all_examples  = []
-
-        while example_cnt < example_num:
-            print('current examples number is %d'%(example_cnt))
-            generated_examples = self.generate_examples_of_blog(current_blog_id)
-            
-            all_examples.extend(generated_examples)
-            
-            current_blog_id+=1
-            example_cnt +=len(generated_examples)
-
-
-        print('final blog id is %d'%(current_blog_id))
-        print('Generate %d examples'%(len(all_examples)))
-        
         print('write to file %s'%(save_path))
-        with open(save_path,"w",encoding="utf-8") as f:
-            for i,example in enumerate(all_examples):
-                if (i+1) % 100 == 0:
-                    print('save %d line to file %s'%(i,save_path))
-                line = example.to_dataline()
-                f.write(line+"\n")
+        with open(save_path,"w",encoding="utf-8",buffering=WRITE_BUFFER_SIZE) as f:
+            for examples in batch_examples(self.iter_examples(example_num,start_blog_id,end_blog_id),SEGMENT_BATCH_SIZE):
+                write_examples(f,examples)
+                example_cnt += len(examples)
+                if example_cnt // flush_every > (example_cnt-len(examples)) // flush_every:
+                    f.flush()
+                    print('save %d line to file %s'%(example_cnt,save_path))
+
+        print('Generate %d examples'%(example_cnt))
         print('save complete')
-        return all_examples
+        return example_cnt
 
-    
+    # examples of the blogs from start_blog_id, until about example_num examples or end_blog_id (exclusive)
+    def iter_examples(self,example_num=50000,start_blog_id=1,end_blog_id=None):
+        example_cnt = 0
+        cur = self.conn.cursor()
+        if end_blog_id is None:
+            cur.execute("SELECT blog_id FROM blogs WHERE blog_id >= ? ORDER BY blog_id",(start_blog_id,))
+        else:
+            cur.execute("SELECT blog_id FROM blogs WHERE blog_id >= ? AND blog_id < ? ORDER BY blog_id",(start_blog_id,end_blog_id))
+        for blog_id, in cur:
+            if example_num is not None and example_cnt >= example_num:
+                print('final blog id is %d'%(blog_id))
+                break
+            generated_examples = self.generate_examples_of_blog(blog_id)
+            example_cnt +=len(generated_examples)
+            yield from generated_examples
 
+    # the blog_id after the last blog of about example_num examples from start_blog_id, counted from the comments (N positives + N negatives per blog)
+    def find_end_blog_id(self,example_num,start_blog_id=1):
+        example_cnt = 0
+        cur = self.conn.cursor()
+        cur.execute("SELECT blog_id,COUNT(*) FROM comments WHERE blog_id >= ? GROUP BY blog_id ORDER BY blog_id",(start_blog_id,))
+        blog_id = start_blog_id - 1
+        for blog_id,comment_num in cur:
+            example_cnt += comment_num*2
+            if example_cnt >= example_num:
+                break
+        return blog_id + 1
+
+    # 平行產生: blog_id ranges of shard_blogs blogs are generated by the workers into shard files
+    # the output only depends on the seed and shard_blogs, the shards are merged into save_path in order if merge is True
+    def generate_examples_sharded(self,save_path,example_num=50000,workers=None,seed=0,start_blog_id=1,shard_blogs=SHARD_BLOGS,merge=True):
+        db_path = self.conn.execute("PRAGMA database_list").fetchone()[2]
+        end_blog_id = self.find_end_blog_id(example_num,start_blog_id)
+        shard_paths,tasks = [],[]
+        for shard_start in range(start_blog_id,end_blog_id,shard_blogs):
+            shard_path = '%s.shard%05d'%(save_path,len(tasks))
+            shard_paths.append(shard_path)
+            tasks.append((db_path,shard_path,shard_start,min(shard_start+shard_blogs,end_blog_id),seed,None))
+        print('generate blog id %d to %d in %d shards'%(start_blog_id,end_blog_id-1,len(tasks)))
+
+        # the workers memory-map the keys of the sampler instead of loading them again
+        sampler_dir = None
+        if self.sampler is not None:
+            sampler_dir = save_path + '.sampler'
+            self.sampler.save(sampler_dir)
+            tasks = [task[:-1]+(sampler_dir,) for task in tasks]
+
+        with Pool(workers) as pool:
+            example_cnt = sum(pool.imap(generate_shard,tasks))
+        if sampler_dir is not None:
+            shutil.rmtree(sampler_dir)
+
+        if merge:
+            with open(save_path,"wb") as f:
+                for shard_path in shard_paths:
+                    with open(shard_path,"rb") as shard:
+                        shutil.copyfileobj(shard,f)
+                    os.remove(shard_path)
+            shard_paths = [save_path]
+        print('Generate %d examples'%(example_cnt))
+        return example_cnt,shard_paths
 
     def generate_examples_of_blog(self,blog_id):
         blog = Blog.getFromDB(blog_id, conn = self.conn)
@@ -90,7 +189,7 @@ class DatasetGenerator():
         if positive_num == 0:
             return []
         
-        negative_comments = blog.getOtherComments(retreiveCount=negative_num)
+        negative_comments = blog.getOtherComments(retreiveCount=negative_num,rng=self.rng,sampler=self.sampler)
 
 
         pos_examples = [ Example(blog,comment,1) for comment in positive_comments ]
@@ -147,82 +246,200 @@ class Sentence():
     def __repr__(self):
         return "Sentence : %s \n %s\n"%(self.text,str(self.tokens))
 
+# a sentence of a compiled dataset, the tokens are a view of the memory-mapped token array
+class TokenSentence():
+    def __init__(self,tokens):
+        self.tokens = tokens
+
+    def length(self):
+        return len(self.tokens)
+
+    def to_tensor(self):
+        return torch.from_numpy(np.asarray(self.tokens,dtype=np.int64)).to(device)
+
+    def __repr__(self):
+        return "TokenSentence : %s\n"%(str(self.tokens))
+
+# the sentences of a compiled dataset, sentence i is tokens[offsets[i]:offsets[i+1]]
+class FlatSentences():
+    def __init__(self,tokens,offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self,idx):
+        if isinstance(idx,slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return TokenSentence(self.tokens[self.offsets[idx]:self.offsets[idx+1]])
+
+
+# the tokens of all the sentences in one flat array, sentence i is tokens[offsets[i]:offsets[i+1]]
+def flatten_sentences(sentences):
+    if isinstance(sentences,FlatSentences):
+        return sentences.tokens,sentences.offsets
+    lens = np.fromiter((sentence.length() for sentence in sentences),dtype=np.int64,count=len(sentences))
+    offsets = np.zeros(len(sentences)+1,dtype=np.int64)
+    offsets[1:] = np.cumsum(lens)
+    tokens = np.fromiter((token for sentence in sentences for token in sentence.tokens),dtype=np.int64,count=offsets[-1])
+    return tokens,offsets
+
+# padded (N,max_len) tokens of the sentences of indices gathered from the flat array in one op, and their lengths
+def collate_tokens(tokens,offsets,indices):
+    starts = np.asarray(offsets[indices],dtype=np.int64)
+    lens = np.asarray(offsets[indices+1],dtype=np.int64)-starts
+    max_len = int(lens.max()) if len(lens) > 0 else 0
+    if max_len == 0:
+        return np.zeros((len(lens),0),dtype=np.int64),lens
+    steps = np.arange(max_len,dtype=np.int64)
+    mask = steps[None,:] < lens[:,None]
+    positions = np.where(mask,starts[:,None]+steps[None,:],0)
+    padded = np.where(mask,np.asarray(tokens[positions.ravel()],dtype=np.int64).reshape(positions.shape),0)
+    return padded,lens
+
+
+# 依長度分桶: the rows are sorted by length within chunks of chunk_batches batches, so a batch has similar lengths
+# the chunks keep the file order, the order is shared by the labels, the titles and the comments
+def bucket_order(comment_lens,title_lens,batch_size,chunk_batches=BUCKET_CHUNK_BATCHES):
+    chunk_size = batch_size*chunk_batches
+    order = np.arange(len(comment_lens),dtype=np.int64)
+    for start in range(0,len(order),chunk_size):
+        end = min(start+chunk_size,len(order))
+        order[start:end] = start+np.lexsort((-title_lens[start:end],-comment_lens[start:end]))
+    return order
+
+
+# 每個epoch打亂: a new row order for each epoch, drawn from (seed,epoch) so the labels, the titles and the comments get the same one
+# the rows are shuffled, bucketed by length if the lengths are given, then the batches are shuffled
+# only an index array is made, the data (eg. a memory-mapped compiled dataset) is never copied
+class ShuffleOrder():
+    def __init__(self,N,batch_size,seed=0,comment_lens=None,title_lens=None):
+        self.N = N
+        self.batch_size = batch_size
+        self.seed = seed
+        self.comment_lens = comment_lens
+        self.title_lens = title_lens
+        self.epoch = None
+        self.order = None
+
+    def __call__(self,epoch):
+        if epoch != self.epoch:
+            self.order = self.make_order(epoch)
+            self.epoch = epoch
+        return self.order
+
+    def make_order(self,epoch):
+        rng = np.random.default_rng([self.seed,epoch])
+        order = rng.permutation(self.N)
+        if self.comment_lens is not None:
+            order = order[bucket_order(self.comment_lens[order],self.title_lens[order],self.batch_size)]
+        starts = rng.permutation(np.arange(0,self.N,self.batch_size))
+        return np.concatenate([order[start:start+self.batch_size] for start in starts]) if self.N > 0 else order
+
 
 class BatchSentence():
-    def __init__(self,sentences,batch_size):
+    # sentences: a list of Sentence, or FlatSentences of a compiled dataset
+    # order: the row order of the batches, eg. by bucket_order, the file order if None
+    # group_ids: eg. the blog_id of each row, the rows of a batch with the same id are padded once,
+    #            and next_batch also gives the index of each row into the unique rows
+    def __init__(self,sentences,batch_size,order=None,group_ids=None):
         self.batch_size = batch_size
         self.sentences = sentences
-        self.indexer = BatchIndexer(len(self.sentences),batch_size)
+        self.tokens,self.offsets = flatten_sentences(sentences)
+        self.indexer = BatchIndexer(len(self.sentences),batch_size,order)
+        self.group_ids = group_ids
 
+        # real tokens / padded tokens of the current pass and of the last complete pass
+        self.real_tokens,self.padded_tokens = 0,0
+        self.last_padding = None
+        self.device = device
 
         #self.buffer = {}
 
     def next_batch(self):
-        intv = self.indexer.next_batch_interval()
-        if intv is None:
+        indices = self.indexer.next_batch_indices()
+        if indices is None:
             return None  
+        elif self.group_ids is not None:
+            # 同一篇文章的標題只編碼一次
+            _,unique_idx,inverse = np.unique(np.asarray(self.group_ids[indices]),return_index=True,return_inverse=True)
+            sentences_2dtensors,len_2dtensor = self.pad_sentences(indices[unique_idx])
+            return sentences_2dtensors,len_2dtensor,torch.from_numpy(inverse.reshape(-1)).to(self.device)
         else:
-            start_idx,end_idx = intv
-            sentences_tensors = [sentence.to_tensor()  for sentence in self.sentences[start_idx:end_idx]]
-            sentences_2dtensors,len_2dtensor = self.pad_sentences(sentences_tensors)
+            sentences_2dtensors,len_2dtensor = self.pad_sentences(indices)
             return sentences_2dtensors,len_2dtensor
 
     def rewind(self):
+        if self.padded_tokens > 0:
+            self.last_padding = (self.real_tokens,self.padded_tokens)
+        self.real_tokens,self.padded_tokens = 0,0
         self.indexer.rewind()
+
+    def padding_efficiency(self):
+        real_tokens,padded_tokens = self.last_padding or (self.real_tokens,self.padded_tokens)
+        return real_tokens/padded_tokens if padded_tokens > 0 else 1.0
  
-    # tensors list of 1d tensors
-    def pad_sentences(self,tensors):
-        lens = torch.stack([torch.tensor(tensor.size(0)) for tensor in tensors])
-        sorted_lens,sorted_idx = torch.sort(lens,descending=True)
-        max_len = torch.max(lens)
-        padded_tensor = torch.zeros(lens.size(0),max_len,device=device,dtype=torch.int64)
-        for i,(t,l) in enumerate(zip(tensors,lens)):
-            padded_tensor[i,0:l] = t
-        sorted_padded_tensor = padded_tensor[sorted_idx]
-        return sorted_padded_tensor,sorted_lens
+    # rows in the order of indices, the same as the labels and the other fields of the batch
+    # pack_padded_sequence(enforce_sorted=False) in match.dynamic_rnn sorts and unsorts them on its own
+    def pad_sentences(self,indices):
+        padded,lens = collate_tokens(self.tokens,self.offsets,indices)
+        self.real_tokens += int(lens.sum())
+        self.padded_tokens += padded.size
+        return torch.from_numpy(padded).to(self.device),torch.from_numpy(lens)
 
 class BatchX():
     def __init__(self,batch_title,batch_comment): 
         self.batch_title = batch_title
         self.batch_comment = batch_comment
 
+    # (title,comment), or (title,comment,title_index) when the titles are grouped, as the arguments of PIXNETNET.forward
     def next_batch(self):
         x1 = self.batch_title.next_batch()
         if x1 is None:
             assert self.batch_comment.next_batch() is None
             return None
+        if len(x1) == 3:
+            return x1[:2],self.batch_comment.next_batch(),x1[2]
         return x1,self.batch_comment.next_batch()
 
     def rewind(self):
         self.batch_title.rewind()
         self.batch_comment.rewind()
+
+    def padding_efficiency(self):
+        return self.batch_title.padding_efficiency(),self.batch_comment.padding_efficiency()
     
 class BatchLabel():
-    def __init__(self,labels,batch_size):
+    def __init__(self,labels,batch_size,order=None):
         self.batch_size = batch_size
-        self.labels = labels
-        self.indexer = BatchIndexer(len(self.labels),batch_size)
+        self.labels = np.asarray(labels)
+        self.indexer = BatchIndexer(len(self.labels),batch_size,order)
+        self.device = device
 
     def next_batch(self):
-        intv = self.indexer.next_batch_interval()
-        if intv is None:
+        indices = self.indexer.next_batch_indices()
+        if indices is None:
             return None
         else:
-            start_idx,end_idx = intv
-            tensor = torch.tensor(self.labels[start_idx:end_idx],device=device)
+            tensor = torch.from_numpy(np.asarray(self.labels[indices],dtype=np.int64)).to(self.device)
             return tensor
 
     def rewind(self):
         self.indexer.rewind()
 
 class BatchIndexer():
-    def __init__(self,N,batch_size):
+    # order: the row order of the batches, the file order if None, or a ShuffleOrder for a new order each epoch
+    def __init__(self,N,batch_size,order=None):
         self.batch_size = batch_size
         self.current_idx = 0
         self.N = N
+        self.order = order
+        self.epoch = 0
 
     def rewind(self):
         self.current_idx = 0
+        self.epoch += 1
 
     def next_batch_interval(self):
         if self.current_idx == -1:
@@ -239,51 +456,344 @@ class BatchIndexer():
 
         return tmp_current_idx,end_idx
 
+    def next_batch_indices(self):
+        intv = self.next_batch_interval()
+        if intv is None:
+            return None
+        start_idx,end_idx = intv
+        if self.order is None:
+            return np.arange(start_idx,end_idx,dtype=np.int64)
+        order = self.order(self.epoch) if callable(self.order) else self.order
+        return order[start_idx:end_idx]
+
+# prepare the next batches of X and y on a background thread while the model runs on the current one
+# X and y are used through the views prefetcher.X and prefetcher.y, which have next_batch and rewind as BatchX and BatchLabel
+# on gpu the batches are made on cpu, pinned and copied asynchronously, the lengths stay on cpu for pack_padded_sequence
+class Prefetcher():
+    def __init__(self,batch_x,batch_y,depth=PREFETCH_BATCHES):
+        self.batch_x = batch_x
+        self.batch_y = batch_y
+        self.depth = depth
+        self.pin = device.type == 'cuda'
+        if self.pin:
+            for batcher in [batch_x.batch_title,batch_x.batch_comment,batch_y]:
+                batcher.device = torch.device('cpu')
+        self.X = PrefetchView(self,'x',batch_x)
+        self.y = PrefetchView(self,'y',batch_y)
+        self.thread = None
+        self.start()
+
+    def start(self):
+        self.queue = queue.Queue(self.depth)
+        self.stop = threading.Event()
+        self.pending = {}
+        self.exhausted = False
+        self.rewound = True
+        self.thread = threading.Thread(target=self.produce,args=(self.queue,self.stop),daemon=True)
+        self.thread.start()
+
+    def produce(self,q,stop):
+        try:
+            while not stop.is_set():
+                x,y = self.batch_x.next_batch(),self.batch_y.next_batch()
+                if self.pin and x is not None:
+                    x = tuple((self.to_device(sentences),lens) for sentences,lens in x[:2])+tuple(self.to_device(index) for index in x[2:])
+                    y = self.to_device(y)
+                self.put(q,stop,(x,y))
+                if x is None:
+                    break
+        except Exception as e:
+            self.put(q,stop,e)
+
+    # wait for a free slot, unless the pass is stopped by rewind
+    def put(self,q,stop,item):
+        while not stop.is_set():
+            try:
+                q.put(item,timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def to_device(self,tensor):
+        return tensor.pin_memory().to(device,non_blocking=True)
+
+    def next_batch(self,name):
+        if name not in self.pending:
+            if self.exhausted:
+                return None
+            item = self.queue.get()
+            if isinstance(item,Exception):
+                raise item
+            x,y = item
+            self.exhausted = x is None
+            self.rewound = False
+            self.pending = {'x':x,'y':y}
+        return self.pending.pop(name)
+
+    # the first rewind of X and y restarts the pass, the other one is a no-op
+    def rewind(self):
+        if self.rewound:
+            return
+        self.stop.set()
+        self.thread.join()
+        self.batch_x.rewind()
+        self.batch_y.rewind()
+        self.start()
+
+
+class PrefetchView():
+    def __init__(self,prefetcher,name,batcher):
+        self.prefetcher = prefetcher
+        self.name = name
+        self.batcher = batcher
+
+    def next_batch(self):
+        return self.prefetcher.next_batch(self.name)
+
+    def rewind(self):
+        self.prefetcher.rewind()
+
+    # padding_efficiency etc. of the wrapped batcher
+    def __getattr__(self,name):
+        return getattr(self.batcher,name)
+
+
+# 資料格式: label\tblog_id\tcomment_id\ttitle\tcomment, with \\ \t \n \r escaped in the texts
+# the old label,blog_id,comment_id,title,comment format can still be read
+ESCAPES = {'\\':'\\\\','\t':'\\t','\n':'\\n','\r':'\\r'}
+UNESCAPES = {'\\':'\\','t':'\t','n':'\n','r':'\r'}
+
+def escape_field(text):
+    return text.translate(str.maketrans(ESCAPES))
+
+def unescape_field(text):
+    if '\\' not in text:
+        return text
+    return re.sub(r'\\(.)',lambda m: UNESCAPES.get(m.group(1),m.group(0)),text)
+
+def to_record(label,blog_id,comment_id,blog_title,comment_body):
+    return '%d\t%d\t%d\t%s\t%s'%(label,blog_id,comment_id,escape_field(blog_title),escape_field(comment_body))
+
+# raise ValueError if the line is neither a record nor an old comma separated line
+def parse_dataline(line):
+    fields = line.rstrip('\r\n').split('\t')
+    if len(fields) == 5:
+        try:
+            return int(fields[0]),int(fields[1]),int(fields[2]),unescape_field(fields[3]),unescape_field(fields[4])
+        except ValueError:
+            pass
+    line = line.rstrip()
+    label,blog_id,comment_id,blog_title,comment_body = line.split(",")
+    label,blog_id,comment_id =  int(label),int(blog_id),int(comment_id)
+    return label,blog_id,comment_id,blog_title,comment_body
+
+# 逐批讀取: lists of at most chunk_size records, the file is never loaded at once
+# bad rows are skipped and counted in stats['bad'] (the first few are printed), or raise ValueError if strict
+def iter_record_chunks(path,chunk_size=RECORD_CHUNK_ROWS,strict=False,stats=None):
+    stats = stats if stats is not None else {}
+    stats.update(rows=0,bad=0)
+    chunk = []
+    with open(path,'rb') as f:
+        for line_num,raw in enumerate(f,1):
+            if not raw.strip():
+                continue
+            try:
+                record = parse_dataline(raw.decode('utf-8'))
+            except (ValueError,UnicodeDecodeError) as e:
+                if strict:
+                    raise ValueError('bad row at line %d of %s: %s'%(line_num,path,e))
+                stats['bad'] += 1
+                if stats['bad'] <= 10:
+                    print('skip bad row at line %d of %s: %s'%(line_num,path,e))
+                continue
+            stats['rows'] += 1
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+    if stats['bad'] > 0:
+        print('%d bad rows skipped in %s'%(stats['bad'],path))
+
+def iter_records(path,chunk_size=RECORD_CHUNK_ROWS,strict=False,stats=None):
+    for chunk in iter_record_chunks(path,chunk_size,strict,stats):
+        yield from chunk
+
+def write_tokens(f,token_lists):
+    tokens = np.fromiter((token for tokens in token_lists for token in tokens),dtype=np.int32)
+    f.write(tokens.tobytes())
+    return len(tokens)
+
+# 把文字檔的資料轉成binary: the tokens of the titles and the comments in two flat int32 files,
+# their offsets, the labels/ids and the frozen vocab, which DataLoader memory-maps when the path is a directory
+# vocab: the vocab of the training set for val/test data, built from this file if None
+def compile_dataset(path,save_dir,vocab=None,strict=False):
+    build_vocab = vocab is None
+    if build_vocab:
+        vocab = Vocab()
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    labels,blog_ids,comment_ids = [],[],[]
+    offsets = {'title':[0],'comment':[0]}
+    rows = {'title':[],'comment':[]}
+    files = {field:open(os.path.join(save_dir,'%s_tokens.bin'%(field)),'wb') for field in rows}
+
+    def flush():
+        for field in rows:
+            write_tokens(files[field],rows[field])
+            rows[field] = []
+
+    for label,blog_id,comment_id,blog_title,comment_body in iter_records(path,strict=strict):
+        # same word order as load_raw_data, so the ids of the vocab are the same
+        if build_vocab:
+            vocab.add_wordlist(blog_title.split(" "))
+            vocab.add_wordlist(comment_body.split(" "))
+        for field,text in (('title',blog_title),('comment',comment_body)):
+            tokens = vocab.encode(text)
+            rows[field].append(tokens)
+            offsets[field].append(offsets[field][-1]+len(tokens))
+        labels.append(label)
+        blog_ids.append(blog_id)
+        comment_ids.append(comment_id)
+        if len(labels) % COMPILE_CHUNK_ROWS == 0:
+            flush()
+            print('compile %d lines of %s'%(len(labels),path))
+    flush()
+    for field in files:
+        files[field].close()
+
+    for name,array in (('labels',labels),('blog_ids',blog_ids),('comment_ids',comment_ids),\
+                       ('title_offsets',offsets['title']),('comment_offsets',offsets['comment'])):
+        np.save(os.path.join(save_dir,'%s.npy'%(name)),np.array(array,dtype=np.int64))
+    with open(os.path.join(save_dir,'vocab.pkl'),'wb') as f:
+        pkl.dump(vocab,f)
+    with open(os.path.join(save_dir,'meta.json'),'w') as f:
+        json.dump({'rows':len(labels),'title_tokens':offsets['title'][-1],'comment_tokens':offsets['comment'][-1],'vocab_size':vocab.size()},f)
+    print('compile %d lines to %s'%(len(labels),save_dir))
+    return vocab
+
+class CompiledDataset():
+    def __init__(self,save_dir,mmap=True):
+        with open(os.path.join(save_dir,'meta.json'),'r') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(save_dir,'vocab.pkl'),'rb') as f:
+            self.vocab = pkl.load(f)
+        mode = 'r' if mmap else None
+        for name in ['labels','blog_ids','comment_ids','title_offsets','comment_offsets']:
+            setattr(self,name,np.load(os.path.join(save_dir,'%s.npy'%(name)),mmap_mode=mode))
+        # np.memmap does not accept an empty file
+        self.title_tokens = self.load_tokens(os.path.join(save_dir,'title_tokens.bin'),self.meta['title_tokens'],mmap)
+        self.comment_tokens = self.load_tokens(os.path.join(save_dir,'comment_tokens.bin'),self.meta['comment_tokens'],mmap)
+
+    def load_tokens(self,path,size,mmap):
+        if size == 0:
+            return np.zeros(0,dtype=np.int32)
+        if mmap:
+            return np.memmap(path,dtype=np.int32,mode='r',shape=(size,))
+        return np.fromfile(path,dtype=np.int32)
+
+    def __len__(self):
+        return self.meta['rows']
+
+
+# the batchers of the labels, the titles and the comments with one shared order
+# blog_ids: the titles of a blog in a batch are encoded once, see BatchSentence
+def make_batches(labels,titles,comments,batch_size,bucket=False,shuffle=False,seed=0,blog_ids=None):
+    batch_title,batch_comment = BatchSentence(titles,batch_size,group_ids=blog_ids),BatchSentence(comments,batch_size)
+    order = None
+    if shuffle and bucket:
+        order = ShuffleOrder(len(labels),batch_size,seed,np.diff(batch_comment.offsets),np.diff(batch_title.offsets))
+    elif shuffle:
+        order = ShuffleOrder(len(labels),batch_size,seed)
+    elif bucket:
+        order = bucket_order(np.diff(batch_comment.offsets),np.diff(batch_title.offsets),batch_size)
+    if order is not None:
+        batch_title.indexer.order = order
+        batch_comment.indexer.order = order
+    return BatchLabel(labels,batch_size,order),batch_title,batch_comment
+
+
 class DataLoader():
     # vocab paramemter:  context --> using training set vocab for test data
-    def __init__(self,vocab=None):
+    # strict: raise on a bad row instead of skipping it
+    def __init__(self,vocab=None,strict=False):
         self.vocab = vocab
+        self.strict = strict
 
-        self.raw_datas =None
-        self.preprocessed_datas = []
+        # labels,blog_ids,titles,comments of a text file, the texts as FlatSentences
+        self.encoded = None
         self.batch_data = None
+        self.compiled = None
     
 
-    def load_all(self,path,batch_size):
+    # path: a text file, or a directory made by compile_dataset
+    # bucket: batch the rows of similar lengths together to cut the padding, see bucket_order
+    # shuffle: a new order each epoch drawn from seed, see ShuffleOrder
+    # group_titles: encode the title of a blog once per batch, it saves the most in the file order where the rows of a blog are together
+    def load_all(self,path,batch_size,bucket=False,shuffle=False,seed=0,group_titles=True):
+        if os.path.isdir(path):
+            self.load_compiled(path)
+            self.load_compiled_batches(batch_size,bucket,shuffle,seed,group_titles)
+            return
         self.load_raw_data(path)
-        self.preprocessing()
-        self.load_batches(batch_size)
+        self.load_batches(batch_size,bucket,shuffle,seed,group_titles)
+
+    def load_compiled(self,path):
+        compiled = CompiledDataset(path)
+        if self.vocab is not None and self.vocab.w2id != compiled.vocab.w2id:
+            raise ValueError('%s is compiled with another vocab, compile it with the vocab of the training set'%(path))
+        self.vocab = compiled.vocab
+        self.compiled = compiled
+
+    def load_compiled_batches(self,batch_size,bucket=False,shuffle=False,seed=0,group_titles=True):
+        compiled = self.compiled
+        titles = FlatSentences(compiled.title_tokens,compiled.title_offsets)
+        comments = FlatSentences(compiled.comment_tokens,compiled.comment_offsets)
+        blog_ids = compiled.blog_ids if group_titles else None
+        self.batch_data = make_batches(compiled.labels,titles,comments,batch_size,bucket,shuffle,seed,blog_ids)
     
+    # 逐批讀取並編碼: one pass over the chunks of the file, only the tokens are kept, in flat int32 arrays
+    # the words of a row are added to the vocab before the row is encoded, so the ids are the same as building the whole vocab first
     def load_raw_data(self,path):
-        datas = []
-        with open(path,"r",encoding="utf-8") as f:
-            for line in f.readlines():
-                line = line.rstrip()
-                label,blog_id,comment_id,blog_title,comment_body = line.split(",")
-                label,blog_id,comment_id =  int(label),int(blog_id),int(comment_id)
-                datas.append((label,blog_id,comment_id,blog_title,comment_body))
-
-        if self.vocab is None:
-            vocab = Vocab()
-            for label,blog_id,comment_id,blog_title,comment_body in datas:
-                vocab.add_wordlist(blog_title.split(" "))
-                vocab.add_wordlist(comment_body.split(" "))  
-            self.vocab =vocab
-        
-        self.raw_datas = datas
-
-    def preprocessing(self):
-        for label,blog_id,comment_id,title,comment in self.raw_datas:
-            self.preprocessed_datas.append((label,Sentence(title,self.vocab),Sentence(comment,self.vocab)))
-    
-    def load_batches(self,batch_size):
-        labels,titles,comments = tuple(zip(*self.preprocessed_datas ))
-        batch_labels,batch_title,batch_comment = BatchLabel(labels,batch_size),BatchSentence(titles,batch_size),BatchSentence(comments,batch_size)
-        self.batch_data =  batch_labels,batch_title,batch_comment
+        build_vocab = self.vocab is None
+        if build_vocab:
+            self.vocab = Vocab()
+        labels,blog_ids = [],[]
+        tokens = {'title':[],'comment':[]}
+        lens = {'title':[],'comment':[]}
+        for chunk in iter_record_chunks(path,strict=self.strict):
+            chunk_tokens = {'title':[],'comment':[]}
+            for label,blog_id,comment_id,blog_title,comment_body in chunk:
+                if build_vocab:
+                    self.vocab.add_wordlist(blog_title.split(" "))
+                    self.vocab.add_wordlist(comment_body.split(" "))
+                chunk_tokens['title'].append(self.vocab.encode(blog_title))
+                chunk_tokens['comment'].append(self.vocab.encode(comment_body))
+            labels.append(np.fromiter((row[0] for row in chunk),dtype=np.int64,count=len(chunk)))
+            blog_ids.append(np.fromiter((row[1] for row in chunk),dtype=np.int64,count=len(chunk)))
+            for field,token_lists in chunk_tokens.items():
+                lens[field].append(np.fromiter(map(len,token_lists),dtype=np.int64,count=len(token_lists)))
+                tokens[field].append(np.fromiter((token for row_tokens in token_lists for token in row_tokens),dtype=np.int32))
+
+        sentences = {}
+        for field in tokens:
+            offsets = np.zeros(sum(map(len,lens[field]))+1,dtype=np.int64)
+            offsets[1:] = np.cumsum(np.concatenate(lens[field]+[np.zeros(0,dtype=np.int64)]))
+            sentences[field] = FlatSentences(np.concatenate(tokens[field]+[np.zeros(0,dtype=np.int32)]),offsets)
+        empty = np.zeros(0,dtype=np.int64)
+        self.encoded = np.concatenate(labels+[empty]),np.concatenate(blog_ids+[empty]),sentences['title'],sentences['comment']
+
+    def load_batches(self,batch_size,bucket=False,shuffle=False,seed=0,group_titles=True):
+        labels,blog_ids,titles,comments = self.encoded
+        blog_ids = blog_ids if group_titles else None
+        self.batch_data = make_batches(labels,titles,comments,batch_size,bucket,shuffle,seed,blog_ids)
 
 
  
 
 #connection = sqlite3.connect(DB_FILE)
-#maker = DatasetGenerator(connection)
+#maker = DatasetGenerator(connection,sampler=NegativeSampler.build(connection))
 #maker.generate_examples('./train.txt',1000000)
+#maker.generate_examples_sharded('./train.txt',1000000,workers=32,seed=0)
@@ -1,5 +1,9 @@
 import json
 import csv
+import os
+import argparse
+import collections
+from multiprocessing import Pool
 from bs4 import BeautifulSoup, Comment
 import re
 
@@ -15,6 +19,8 @@ FILE_D = "comments_partition"
 FILE_E = "tags_partition"
 FILE_F = "keywords_partition"
 PARTITION_SIZE = 5000
+CHUNK_BYTES = 8 * 1024 * 1024
+WRITE_BUFFER_BYTES = 1024 * 1024
 
 data_columns = ["blog_id", "title", "body", "comments", "tags", "keywords"]
 blog_columns = ["blog_id", "title", "body"]
@@ -22,127 +28,255 @@ comment_columns = ["blog_id", "comment_id", "comments", "replys"]
 tag_columns = ["blog_id", "tag_id", "tags"]
 keyword_columns = ["blog_id", "keywords_id", "keywords"]
 
+INLINE_ELES = ["a", "abbr", "acronym", "b", "bdo", "big", "button", "cite", "code",
+                "dfn", "em", "i", "label", "kbd", "map", "object", "q", "samp",
+                "small", "span", "strong", "sub", "sup", "time", "tt", "var"]
 
-with open(FILE_FULL_DIR + FILE_A + ".csv", "w", newline='', encoding="utf-8") as f:
-    writer = csv.writer(f);
-    writer.writerow(data_columns)
 
-def createPartitionFiles(id):
-    with open(FILE_PART_DIR + FILE_B + "_" + str(id) + ".csv", "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(data_columns)
+def stripHTML(html):
+    '''
+        Keep the visible text of a HTML blog body.
 
-    with open(FILE_DB_DIR + FILE_C + "_" + str(id) + ".csv", "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(blog_columns)
+        Parameters
+        ====================================
 
-    with open(FILE_DB_DIR + FILE_D + "_" + str(id) + ".csv", "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(comment_columns)
+        html    `str`   - The raw HTML body.
 
-    with open(FILE_DB_DIR + FILE_E + "_" + str(id) + ".csv", "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(tag_columns)
+        Returns
+        ====================================
 
-    with open(FILE_DB_DIR + FILE_F + "_" + str(id) + ".csv", "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(keyword_columns)
+        `str`   - The text content, with consecutive new lines merged.
+    '''
+    return re.sub("\n+", "\n", "".join([s for s in BeautifulSoup(html, "html.parser").find_all(string=True) if (s.parent.name not in ["script", "style", "select", "option"] and not isinstance(s, Comment))]))
 
-def writeBigCSV(ary):
-    with open(FILE_FULL_DIR + FILE_A + ".csv", "a", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerows(ary)
+def parseLine(line):
+    '''
+        Parse one line of the raw JSONL dump.
 
-def writePartCSV(partition_count, partCSV, bodyCSV, commentCSV, tagCSV, keywordCSV):
-    with open(FILE_PART_DIR + FILE_B + "_" + str(partition_count) + ".csv", "a", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerows(partCSV)
+        Parameters
+        ====================================
 
-    with open(FILE_DB_DIR + FILE_C + "_" + str(partition_count) + ".csv", "a", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerows(bodyCSV)
+        line    `str`   - A JSON object of a blog.
 
-    with open(FILE_DB_DIR + FILE_D + "_" + str(partition_count) + ".csv", "a", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerows(commentCSV)
-    
-    with open(FILE_DB_DIR + FILE_E + "_" + str(partition_count) + ".csv", "a", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerows(tagCSV)
+        Returns
+        ====================================
+
+        `tuple`  - (title, body, comments, tags, keywords) where body is stripped from HTML.
+    '''
+    data = json.loads(line)
+    body = stripHTML(data["body"])
+    return (data["title"], body, data["comments"], data["tags"], data["keywords"])
+
+def findChunks(filepath, chunkBytes = CHUNK_BYTES):
+    '''
+        Split a JSONL file into byte ranges aligned on line breaks.
+
+        Parameters
+        ====================================
+
+        filepath    `str`   - The path of the JSONL file.
+        chunkBytes  `int`   - The approximated size of each chunk.
+
+        Returns
+        ====================================
+
+        `list[tuple(int,int)]`  - A list of (start, end) byte offsets covering the whole file.
+    '''
+    size = os.path.getsize(filepath)
+    chunks = []
+    with open(filepath, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunkBytes, size))
+            # Move to the end of the current line
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def parseChunk(args):
+    '''
+        Parse all the lines in a byte range of the JSONL file, typically run in a worker process.
+
+        Parameters
+        ====================================
+
+        args    `tuple(str,int,int)`   - (filepath, start, end)
+
+        Returns
+        ====================================
+
+        `list[tuple]`  - Parsed lines of this chunk, see parseLine.
+    '''
+    filepath, start, end = args
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    return [parseLine(line) for line in raw.decode("utf-8").split("\n") if line.strip()]
+
+def iterParsedChunks(filepath, workers = None, chunkBytes = CHUNK_BYTES):
+    '''
+        Parse a JSONL file in a process pool, yielding the chunks in the file order.
+
+        Parameters
+        ====================================
+
+        filepath    `str`   - The path of the JSONL file.
+        workers     `int`   - The number of worker processes, parse in the current process if 1 is given. Default as the cpu count.
+        chunkBytes  `int`   - The approximated size of each chunk.
 
-    with open(FILE_DB_DIR + FILE_F + "_" + str(partition_count) + ".csv", "a", newline='', encoding="utf-8") as f:
+        Returns
+        ====================================
+
+        `generator(tuple(list[tuple], int, int))`  - (parsed lines, end byte offset, file size) of each chunk.
+    '''
+    size = os.path.getsize(filepath)
+    tasks = [(filepath, start, end) for start, end in findChunks(filepath, chunkBytes)]
+    workers = workers or os.cpu_count()
+
+    if workers <= 1:
+        for task in tasks:
+            yield parseChunk(task), task[2], size
+        return
+
+    # Keep a bounded number of chunks in flight so that memory does not grow with the file size
+    with Pool(workers) as pool:
+        pending = collections.deque()
+        taskIter = iter(tasks)
+        for task in taskIter:
+            pending.append((pool.apply_async(parseChunk, (task,)), task[2]))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            result, end = pending.popleft()
+            task = next(taskIter, None)
+            if task is not None:
+                pending.append((pool.apply_async(parseChunk, (task,)), task[2]))
+            yield result.get(), end, size
+
+
+class PartitionWriter():
+    '''
+        Buffered writer of the full CSV, the partitioned CSV and the DB-like CSV files.
+    '''
+    def __init__(self, fullDir = FILE_FULL_DIR, partDir = FILE_PART_DIR, dbDir = FILE_DB_DIR, partitionSize = PARTITION_SIZE, bufferSize = WRITE_BUFFER_BYTES):
+        '''
+            Create the writer and the full CSV file.
+
+            Parameters
+            ====================================
+
+            fullDir         `str`   - The folder of the full CSV file.
+            partDir         `str`   - The folder of the partitioned CSV files.
+            dbDir           `str`   - The folder of the DB-like CSV files, which is the source of db_api.initData.
+            partitionSize   `int`   - The number of blogs in each partition.
+            bufferSize      `int`   - The write buffer size of each file.
+        '''
+        self.fullDir = fullDir
+        self.partDir = partDir
+        self.dbDir = dbDir
+        self.partitionSize = partitionSize
+        self.bufferSize = bufferSize
+        self.lineID = 0
+        self.partitionCount = 0
+        self.partitionFiles = []
+
+        self.bigFile, self.bigWriter = self.openCSV(os.path.join(fullDir, FILE_A + ".csv"), data_columns)
+
+    def openCSV(self, path, columns):
+        f = open(path, "w", newline='', encoding="utf-8", buffering=self.bufferSize)
         writer = csv.writer(f)
-        writer.writerows(keywordCSV)
+        writer.writerow(columns)
+        return f, writer
 
-INLINE_ELES = ["a", "abbr", "acronym", "b", "bdo", "big", "button", "cite", "code",
-                "dfn", "em", "i", "label", "kbd", "map", "object", "q", "samp",
-                "small", "span", "strong", "sub", "sup", "time", "tt", "var"]
+    def newPartition(self):
+        self.closePartition()
+        self.partitionCount += 1
+        suffix = "_" + str(self.partitionCount) + ".csv"
+        self.partitionFiles = [
+            self.openCSV(os.path.join(self.partDir, FILE_B + suffix), data_columns),
+            self.openCSV(os.path.join(self.dbDir, FILE_C + suffix), blog_columns),
+            self.openCSV(os.path.join(self.dbDir, FILE_D + suffix), comment_columns),
+            self.openCSV(os.path.join(self.dbDir, FILE_E + suffix), tag_columns),
+            self.openCSV(os.path.join(self.dbDir, FILE_F + suffix), keyword_columns)]
+
+    def closePartition(self):
+        for f, _ in self.partitionFiles:
+            f.close()
+        self.partitionFiles = []
+
+    def write(self, parsed):
+        '''
+            Write a parsed blog, the blog_id is assigned by the order of writing, starting from 1.
+
+            Parameters
+            ====================================
+
+            parsed  `tuple` - A parsed line, see parseLine.
+        '''
+        title, body, comments, tags, keywords = parsed
+        self.lineID += 1
+        line_id = self.lineID
 
-with open(FILEPATH, newline='', encoding='utf-8') as readFile:
-    data = readFile.readline()
-    line_id = 1
-    partition_id = 1
-    partition_count = 0
-    bigCSV = [];
-    partCSV = [];
-    bodyCSV = [];
-    commentCSV = [];
-    tagCSV = [];
-    keywordCSV = [];
-
-    while (data):
-        # Load the object using json
-        data = json.loads(data)
-
-        # Parse HTML
-        body = re.sub("\n+", "\n", "".join([s for s in BeautifulSoup(data["body"], "html.parser").find_all(string=True) if (s.parent.name not in ["script", "style", "select", "option"] and not isinstance(s, Comment))]))
-        
-
-        # Write the data into the big csv
-        bigCSV.append([line_id, data["title"], body, json.dumps(data["comments"]), json.dumps(data["tags"]), json.dumps(data["keywords"])]);
-
-        # Write into file for each 1000 rows
-        if (line_id%500 == 0):
-            writeBigCSV(bigCSV)
-            bigCSV = []
-        
         # For partitioned data, create a new file if needed
-        if (line_id % PARTITION_SIZE == 1):
-            partition_count += 1
-            createPartitionFiles(partition_count)
-        
-        # Write the data into partitioned csv
-        partCSV.append([line_id, data["title"], body, json.dumps(data["comments"]), json.dumps(data["tags"]), json.dumps(data["keywords"])])
-
-        # Write the data into partitioned body csv
-        bodyCSV.append([line_id, data["title"], body])
-        
-        # Write the data into partitioned comments csv
-        for cid,c in enumerate(data["comments"]):
-            commentCSV.append([line_id, cid, c["body"], c["reply"]])
-                
-        # Write the data into partitioned tags csv
-        for tid,tag in enumerate(data["tags"]):
-            tagCSV.append([line_id, tid, tag])
-       
-        # Write the data into partitioned keywords csv
-        for kid,keyword in enumerate(data["keywords"]):
-            keywordCSV.append([line_id, kid, keyword])
-        
-        if (line_id % 1000 == 0):
-            writePartCSV(partition_count, partCSV, bodyCSV, commentCSV, tagCSV, keywordCSV)
-            partCSV = []
-            bodyCSV = []
-            commentCSV = []
-            tagCSV = []
-            keywordCSV = []
-
-        data = readFile.readline()
-        line_id += 1
-        if (line_id % 50 == 0):
-            print(line_id / 208743 * 100, " %")
-
-    writeBigCSV(bigCSV)
-    writePartCSV(partition_count, partCSV, bodyCSV, commentCSV, tagCSV, keywordCSV)
-
-print(line_id)
+        if (line_id % self.partitionSize == 1 or self.partitionSize == 1):
+            self.newPartition()
+        (_, partWriter), (_, blogWriter), (_, commentWriter), (_, tagWriter), (_, keywordWriter) = self.partitionFiles
+
+        row = [line_id, title, body, json.dumps(comments), json.dumps(tags), json.dumps(keywords)]
+        self.bigWriter.writerow(row)
+        partWriter.writerow(row)
+        blogWriter.writerow([line_id, title, body])
+        commentWriter.writerows([[line_id, cid, c["body"], c["reply"]] for cid, c in enumerate(comments)])
+        tagWriter.writerows([[line_id, tid, tag] for tid, tag in enumerate(tags)])
+        keywordWriter.writerows([[line_id, kid, keyword] for kid, keyword in enumerate(keywords)])
+
+    def close(self):
+        self.closePartition()
+        self.bigFile.close()
+
+
+def prepareData(filepath = FILEPATH, workers = None, chunkBytes = CHUNK_BYTES, writer = None):
+    '''
+        Stream the raw JSONL dump into the full, partitioned and DB-like CSV files.
+        HTML parsing is done in a process pool while the writing keeps the order of the dump.
+
+        Parameters
+        ====================================
+
+        filepath    `str`   - The path of the JSONL dump.
+        workers     `int`   - The number of worker processes. Default as the cpu count.
+        chunkBytes  `int`   - The approximated size of the chunk sent to each worker.
+        writer      `PartitionWriter`   - The writer of the outputs. Default as a writer to the global folders.
+
+        Returns
+        ====================================
+
+        `int`   - The number of blogs written.
+    '''
+    writer = writer or PartitionWriter()
+    try:
+        for parsedLines, end, size in iterParsedChunks(filepath, workers, chunkBytes):
+            for parsed in parsedLines:
+                writer.write(parsed)
+            print(end / size * 100, " %")
+    finally:
+        writer.close()
+    return writer.lineID
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Prepare the PIXNET raw data into CSV files')
+    parser.add_argument('-i', '--input', default=FILEPATH)
+    parser.add_argument('-w', '--workers', default=None, type=int)
+    parser.add_argument('-cb', '--chunk_bytes', default=CHUNK_BYTES, type=int)
+    parser.add_argument('-fd', '--full_dir', default=FILE_FULL_DIR)
+    parser.add_argument('-pd', '--part_dir', default=FILE_PART_DIR)
+    parser.add_argument('-dd', '--db_dir', default=FILE_DB_DIR)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arg = parse()
+    lineCount = prepareData(arg.input, arg.workers, arg.chunk_bytes, PartitionWriter(arg.full_dir, arg.part_dir, arg.db_dir))
+    print(lineCount)
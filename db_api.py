@@ -1,11 +1,21 @@
 import sqlite3
 import os
 import csv
+import time
+import argparse
+from dataPreparation import iterParsedChunks
 
 # Data file processing
 DATA_FOLDER = "./"
 DB_FILE = "pixnet.db"
 
+# Secondary indexes, created after a bulk load
+DB_INDEXES = [
+    ("idx_keywords_keywords", "keywords(keywords, blog_id)"),
+    ("idx_tags_tags", "tags(tags, blog_id)"),
+]
+TABLE_COLUMN_COUNT = {"blogs": 3, "comments": 4, "tags": 3, "keywords": 3}
+
 class Blog():
     '''
         Class representing a blog item.
@@ -45,7 +55,7 @@ class Blog():
         comments = cur.fetchall()
         return [Comment(*c) for c in comments]
 
-    def getOtherComments(self, retreiveCount = 5):
+    def getOtherComments(self, retreiveCount = 5, rng = None, sampler = None):
         '''
             Get a list of comments not in this blog.
 
@@ -53,17 +63,60 @@ class Blog():
             ====================================
 
             retreiveCount   `None|int` - The topmost k comments, all if None is given.
+            rng             `None|random.Random` - Sample by rowid with this random generator for a reproducible result, instead of ORDER BY RANDOM().
+            sampler         `None|NegativeSampler` - Sample from the preloaded comment keys, which is the fastest.
 
             Returns
             ====================================
 
             `list(Comment)`  - a list of Comment objects.
         '''
+        if sampler is not None and retreiveCount is not None:
+            return [Comment(*c) for c in sampler.sampleRows(self, retreiveCount, rng)]
+        if rng is not None and retreiveCount is not None:
+            return self.sampleOtherComments(retreiveCount, rng)
         cur = self.conn.cursor()
         cur.execute("SELECT * FROM comments WHERE blog_id != " + str(self.blog_id) + ((" ORDER BY RANDOM() LIMIT " + str(retreiveCount)) if retreiveCount is not None else ""))
         comments = cur.fetchall()
         return [Comment(*c) for c in comments]
     
+    def sampleOtherComments(self, retreiveCount, rng, maxRounds = 10):
+        '''
+            Sample comments not in this blog by random rowids, without sorting the whole comments table.
+
+            Parameters
+            ====================================
+
+            retreiveCount   `int` - The number of comments.
+            rng             `random.Random` - The random generator.
+            maxRounds       `int` - Give up after this number of rounds, eg. when the other blogs have too few comments.
+
+            Returns
+            ====================================
+
+            `list(Comment)`  - a list of Comment objects, in the order of sampling.
+        '''
+        cur = self.conn.cursor()
+        cur.execute("SELECT MAX(rowid) FROM comments")
+        maxRowID = cur.fetchone()[0]
+        if maxRowID is None:
+            return []
+
+        comments = []
+        seen = set()
+        for _ in range(maxRounds):
+            if len(comments) >= retreiveCount:
+                break
+            # Draw the missing number of rowids, the rowids of the deleted rows or this blog are drawn again in the next round
+            rowIDs = [rng.randint(1, maxRowID) for _ in range(retreiveCount - len(comments))]
+            cur.execute("SELECT rowid, * FROM comments WHERE blog_id != ? AND rowid IN (" + ",".join(["?"] * len(rowIDs)) + ")", [self.blog_id] + rowIDs)
+            rows = {r[0]: r[1:] for r in cur.fetchall()}
+            for rowID in rowIDs:
+                if rowID in rows and rowID not in seen and len(comments) < retreiveCount:
+                    seen.add(rowID)
+                    comments.append(Comment(*rows[rowID]))
+        return comments
+
     @staticmethod
     def getFromDB(blog_id, conn = sqlite3.connect(DB_FILE)):
         '''
@@ -122,6 +175,8 @@ def initDB(conn = sqlite3.connect(DB_FILE), closeConnection = False):
     c.execute('''DROP TABLE IF EXISTS comments''')
     c.execute('''DROP TABLE IF EXISTS tags''')
     c.execute('''DROP TABLE IF EXISTS keywords''')
+    # The indexes are dropped with the tables, so the migrations should be applied again
+    c.execute("PRAGMA user_version = 0")
     conn.commit()
 
     # Create tables
@@ -215,6 +270,162 @@ def initData(conn = sqlite3.connect(DB_FILE), dataFolder = DATA_FOLDER, closeCon
     print("Data Initiation - Finished")
     return conn
 
+def iterCSVRows(dataFolder = DATA_FOLDER, firstBlogID = 1):
+    '''
+        Iterate the rows of the DB-like CSV files created by dataPreparation.py.
+
+        Parameters
+        ====================================
+
+        dataFolder  `str`   - The folder of the DB-like CSV files.
+        firstBlogID `int`   - The blog_id of the CSV blog_id 1, the blog_ids of all the tables are shifted by the same offset, eg. the next blog_id of the database when appending.
+
+        Returns
+        ====================================
+
+        `generator(tuple(str, tuple))`  - (table, row) with the ids converted to int.
+    '''
+    for root, dirs, filenames in os.walk(dataFolder):
+        for filename in sorted(filenames):
+            table = filename.split(".")[0].split("_")[0]
+            if table not in TABLE_COLUMN_COUNT:
+                continue
+            print("Bulk Load - Data Reading - " + filename)
+            idCount = 1 if table == "blogs" else 2
+            with open(os.path.join(root, filename), 'r', encoding="utf-8", newline="") as file:
+                # NOTED there is a NULL byte that can affect CSV reading
+                csvReader = csv.reader(line.replace('\0','') for line in file)
+                next(csvReader, None)
+                for row in csvReader:
+                    ids = [int(c) for c in row[:idCount]]
+                    ids[0] += firstBlogID - 1
+                    yield table, (*ids, *row[idCount:])
+
+def iterDumpRows(filepath, workers = None, firstBlogID = 1):
+    '''
+        Iterate the rows of the raw JSONL dump, parsed in a process pool. The blog_id is the line number starting from firstBlogID, the same as dataPreparation.py by default.
+
+        Parameters
+        ====================================
+
+        filepath    `str`   - The path of the JSONL dump.
+        workers     `int`   - The number of worker processes. Default as the cpu count.
+        firstBlogID `int`   - The blog_id of the first line, eg. the next blog_id of the database when appending a new dump.
+
+        Returns
+        ====================================
+
+        `generator(tuple(str, tuple))`  - (table, row)
+    '''
+    blog_id = firstBlogID - 1
+    for parsedLines, end, size in iterParsedChunks(filepath, workers):
+        for title, body, comments, tags, keywords in parsedLines:
+            blog_id += 1
+            yield "blogs", (blog_id, title, body)
+            for cid, c in enumerate(comments):
+                yield "comments", (blog_id, cid, c["body"], c["reply"])
+            for tid, tag in enumerate(tags):
+                yield "tags", (blog_id, tid, tag)
+            for kid, keyword in enumerate(keywords):
+                yield "keywords", (blog_id, kid, keyword)
+        print("Bulk Load - Data Reading - ", end / size * 100, " %")
+
+def dropIndexes(conn):
+    c = conn.cursor()
+    for name, _ in DB_INDEXES:
+        c.execute("DROP INDEX IF EXISTS " + name)
+    conn.commit()
+
+def createIndexes(conn):
+    c = conn.cursor()
+    for name, definition in DB_INDEXES:
+        c.execute("CREATE INDEX IF NOT EXISTS " + name + " ON " + definition)
+    conn.commit()
+
+def bulkLoad(rows, conn = sqlite3.connect(DB_FILE), batchSize = 50000, commitEvery = 1000000, clear = True, closeConnection = False):
+    '''
+        Load rows into the database with parameterized executemany in large transactions.
+        The secondary indexes are dropped during the load and created afterwards.
+        The load runs in WAL mode with synchronous=OFF, the previous settings are restored afterwards, also when the load fails.
+
+        Parameters
+        ====================================
+
+        rows        `iterable(tuple(str, tuple))`  - (table, row) pairs, eg. from iterCSVRows or iterDumpRows.
+        conn        `sqlite3.Connection` - A SQLite connection object. Default as the a new connection to the global DB_FILE databse file.
+        batchSize   `int`   - The number of rows of a table sent in one executemany.
+        commitEvery `int`   - The number of rows in one transaction.
+        clear       `bool`  - Whether to delete the existing rows of the tables first.
+        closeConnection     `bool`  - Whether to close connection at the end of calling this function.
+
+        Returns
+        ====================================
+
+        `dict(str, int)`  - The number of rows loaded into each table.
+    '''
+    c = conn.cursor()
+    # The pragmas only hold during the load, the journal mode is persistent in the database file so it is restored too
+    journalMode = c.execute("PRAGMA journal_mode").fetchone()[0]
+    synchronous = c.execute("PRAGMA synchronous").fetchone()[0]
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=OFF")
+    try:
+        dropIndexes(conn)
+
+        if clear:
+            print("Bulk Load - Clearing tables")
+            for table in TABLE_COLUMN_COUNT:
+                c.execute("DELETE FROM " + table)
+            conn.commit()
+
+        buffers = {table: [] for table in TABLE_COLUMN_COUNT}
+        counts = {table: 0 for table in TABLE_COLUMN_COUNT}
+        seconds = {table: 0.0 for table in TABLE_COLUMN_COUNT}
+        sinceCommit = 0
+
+        def flush(table):
+            start = time.time()
+            c.executemany("INSERT INTO " + table + " VALUES(" + ",".join(["?"] * TABLE_COLUMN_COUNT[table]) + ")", buffers[table])
+            seconds[table] += time.time() - start
+            counts[table] += len(buffers[table])
+            buffers[table] = []
+
+        loadStart = time.time()
+        for table, row in rows:
+            buffers[table].append(row)
+            if len(buffers[table]) >= batchSize:
+                sinceCommit += len(buffers[table])
+                flush(table)
+                if sinceCommit >= commitEvery:
+                    conn.commit()
+                    sinceCommit = 0
+        for table in TABLE_COLUMN_COUNT:
+            flush(table)
+        conn.commit()
+        loadSeconds = time.time() - loadStart
+
+        # The rows/sec of each table only count its executemany calls, the total also counts the reading of the rows and the commits
+        for table in TABLE_COLUMN_COUNT:
+            print("Bulk Load - " + table + ": " + str(counts[table]) + " rows, " + str(int(counts[table] / max(seconds[table], 1e-6))) + " rows/sec in executemany")
+        total = sum(counts.values())
+        print("Bulk Load - Total: " + str(total) + " rows in " + str(round(loadSeconds, 2)) + " sec, " + str(int(total / max(loadSeconds, 1e-6))) + " rows/sec")
+
+        print("Bulk Load - Creating indexes")
+        start = time.time()
+        createIndexes(conn)
+        print("Bulk Load - Indexes created in " + str(round(time.time() - start, 2)) + " sec")
+    finally:
+        # The journal mode cannot be changed inside a transaction, eg. of a failed load
+        conn.rollback()
+        c.execute("PRAGMA journal_mode=" + journalMode)
+        c.execute("PRAGMA synchronous=" + str(synchronous))
+
+    if closeConnection:
+        conn.close()
+
+    print("Bulk Load - Finished")
+    return counts
+
 def getDataTrial(conn = sqlite3.connect(DB_FILE), closeConnection = False):
     '''
         Try to get a sample data and print a record if it's fine, typically for the use of a database checking.
@@ -285,3 +496,26 @@ print("Comments in this post:\n", [data.trim_illegal_char(c.body) for c in nowCo
 nowComments = testBlog.getOtherComments(retreiveCount=5)
 print("Comments in other post:\n", [data.trim_illegal_char(c.body) for c in nowComments])
 '''
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Bulk load the PIXNET data into the database')
+    parser.add_argument('source', choices=['dump', 'csv'])
+    parser.add_argument('-i', '--input', default=DATA_FOLDER)
+    parser.add_argument('-db', '--db_path', default=DB_FILE)
+    parser.add_argument('-w', '--workers', default=None, type=int)
+    parser.add_argument('-bs', '--batch_size', default=50000, type=int)
+    parser.add_argument('--init', action='store_true', help='drop and create the tables first')
+    parser.add_argument('--append', action='store_true', help='keep the existing rows and number the new blogs (of a dump or the CSV files) after the last blog_id, for WordDict.update')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arg = parse()
+    connection = sqlite3.connect(arg.db_path)
+    if arg.init:
+        initDB(connection)
+    firstBlogID = 1
+    if arg.append:
+        firstBlogID = (connection.execute("SELECT MAX(blog_id) FROM blogs").fetchone()[0] or 0) + 1
+    rows = iterDumpRows(arg.input, arg.workers, firstBlogID) if arg.source == "dump" else iterCSVRows(arg.input, firstBlogID)
+    bulkLoad(rows, connection, batchSize = arg.batch_size, clear = not arg.append, closeConnection = True)
@@ -0,0 +1,200 @@
+import os
+import json
+import sqlite3
+import numpy as np
+
+DB_FILE = "pixnet.db"
+
+# The term column of each table which can be indexed
+TERM_COLUMNS = {"keywords": "keywords", "tags": "tags"}
+
+class InvertedIndex():
+    '''
+        Inverted index of the keywords or the tags of the blogs, for the co-occurrence similarity.
+    '''
+    def __init__(self, terms, termOffsets, postings, blogIDs, blogOffsets, blogTerms):
+        '''
+            Create an InvertedIndex object, typically by InvertedIndex.build or InvertedIndex.load.
+
+            Parameters
+            ====================================
+
+            terms       `list[str]`     - The term of each term id.
+            termOffsets `np.ndarray`    - The postings of term id t are postings[termOffsets[t]:termOffsets[t+1]].
+            postings    `np.ndarray`    - The sorted blog_ids of each term, one entry per row of the table.
+            blogIDs     `np.ndarray`    - The sorted blog_ids having any term.
+            blogOffsets `np.ndarray`    - The term ids of blogIDs[i] are blogTerms[blogOffsets[i]:blogOffsets[i+1]].
+            blogTerms   `np.ndarray`    - The term ids of each blog.
+        '''
+        self.terms = terms
+        self.termOffsets = termOffsets
+        self.postings = postings
+        self.blogIDs = blogIDs
+        self.blogOffsets = blogOffsets
+        self.blogTerms = blogTerms
+
+    def getTermIDs(self, blog_id):
+        '''
+            Get the distinct term ids of a blog.
+
+            Parameters
+            ====================================
+
+            blog_id     `int`   - The blog_id.
+
+            Returns
+            ====================================
+
+            `np.ndarray`  - The term ids, empty if the blog has no terms.
+        '''
+        row = np.searchsorted(self.blogIDs, blog_id)
+        if row >= len(self.blogIDs) or self.blogIDs[row] != blog_id:
+            return np.zeros(0, dtype=self.blogTerms.dtype)
+        return np.unique(self.blogTerms[self.blogOffsets[row]:self.blogOffsets[row + 1]])
+
+    def query(self, blog_id, retreiveCount = 5, rng = None):
+        '''
+            Get the blogs sharing the most terms with a blog, in a random order among equal counts.
+            It gives the same result as the SQL of Blog.getSimilarBlogsByKeywords / Blog.getSimilarBlogsByTags.
+
+            Parameters
+            ====================================
+
+            blog_id         `int`   - The blog_id.
+            retreiveCount   `None|int` - The topmost k blogs, all if None is given.
+            rng             `np.random.Generator` - The random generator for tie-breaking. Default as the global numpy random state.
+
+            Returns
+            ====================================
+
+            `list[int]`  - The ranked blog_ids.
+        '''
+        termIDs = self.getTermIDs(blog_id)
+        if len(termIDs) == 0:
+            return []
+
+        # Merge the postings of all the terms, and count the occurrences of each blog
+        candidates = np.concatenate([self.postings[self.termOffsets[t]:self.termOffsets[t + 1]] for t in termIDs])
+        candidates = candidates[candidates != blog_id]
+        blog_ids, counts = np.unique(candidates, return_counts=True)
+
+        randomKeys = (rng or np.random).random(len(blog_ids))
+        order = np.lexsort((randomKeys, -counts))
+        if retreiveCount is not None:
+            order = order[:retreiveCount]
+        return blog_ids[order].tolist()
+
+    def queryMany(self, blog_ids, retreiveCount = 5, rng = None):
+        '''
+            Get the similar blogs of a list of blogs, see InvertedIndex.query.
+
+            Parameters
+            ====================================
+
+            blog_ids        `list[int]` - The blog_ids.
+            retreiveCount   `None|int` - The topmost k blogs of each blog, all if None is given.
+            rng             `np.random.Generator` - The random generator for tie-breaking. Default as the global numpy random state.
+
+            Returns
+            ====================================
+
+            `dict(int, list[int])`  - The ranked blog_ids of each blog.
+        '''
+        return {blog_id: self.query(blog_id, retreiveCount, rng) for blog_id in blog_ids}
+
+    def save(self, folder):
+        '''
+            Save the index into a folder, the arrays can be memory-mapped by InvertedIndex.load.
+
+            Parameters
+            ====================================
+
+            folder  `str`   - The folder to save the index.
+        '''
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in ["termOffsets", "postings", "blogIDs", "blogOffsets", "blogTerms"]:
+            np.save(os.path.join(folder, name + ".npy"), getattr(self, name))
+        with open(os.path.join(folder, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+
+    @staticmethod
+    def load(folder, mmap = True):
+        '''
+            Load an index saved by InvertedIndex.save.
+
+            Parameters
+            ====================================
+
+            folder  `str`   - The folder of the index.
+            mmap    `bool`  - Whether to memory-map the arrays instead of reading them into memory.
+
+            Returns
+            ====================================
+
+            `InvertedIndex`  - The index.
+        '''
+        arrays = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r" if mmap else None)
+                    for name in ["termOffsets", "postings", "blogIDs", "blogOffsets", "blogTerms"]}
+        with open(os.path.join(folder, "terms.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        return InvertedIndex(terms, **arrays)
+
+    @staticmethod
+    def build(conn = sqlite3.connect(DB_FILE), table = "keywords"):
+        '''
+            Build the index from the keywords or the tags table.
+
+            Parameters
+            ====================================
+
+            conn    `sqlite3.Connection` - A SQLite connection object. Default as the a new connection to the global DB_FILE databse file.
+            table   `str`   - "keywords" or "tags".
+
+            Returns
+            ====================================
+
+            `InvertedIndex`  - The index.
+        '''
+        cur = conn.cursor()
+        cur.execute("SELECT blog_id, " + TERM_COLUMNS[table] + " FROM " + table)
+        termMap = {}
+        blogColumn = []
+        termColumn = []
+        for blog_id, term in cur:
+            blogColumn.append(blog_id)
+            termColumn.append(termMap.setdefault(term, len(termMap)))
+        terms = [None] * len(termMap)
+        for term, tid in termMap.items():
+            terms[tid] = term
+
+        blogColumn = np.array(blogColumn, dtype=np.int32)
+        termColumn = np.array(termColumn, dtype=np.int32)
+
+        # term -> blogs
+        order = np.lexsort((blogColumn, termColumn))
+        postings = blogColumn[order]
+        termOffsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        termOffsets[1:] = np.cumsum(np.bincount(termColumn, minlength=len(terms)))
+
+        # blog -> terms
+        order = np.argsort(blogColumn, kind="stable")
+        blogIDs, blogCounts = np.unique(blogColumn[order], return_counts=True)
+        blogTerms = termColumn[order]
+        blogOffsets = np.zeros(len(blogIDs) + 1, dtype=np.int64)
+        blogOffsets[1:] = np.cumsum(blogCounts)
+
+        return InvertedIndex(terms, termOffsets, postings, blogIDs, blogOffsets, blogTerms)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the inverted indexes of the keywords and the tags')
+    parser.add_argument('-db', '--db_path', default=DB_FILE)
+    parser.add_argument('-o', '--output_dir', default='./index')
+    arg = parser.parse_args()
+
+    connection = sqlite3.connect(arg.db_path)
+    for table in TERM_COLUMNS:
+        print("Inverted Index - Building " + table)
+        InvertedIndex.build(connection, table).save(os.path.join(arg.output_dir, table))
@@ -1,10 +1,10 @@
-from data import DataLoader,BatchX
-from match import PIXNETNET
+from data import DataLoader,BatchX,Prefetcher,compile_dataset
+from match import PIXNETNET,MODES
 import pickle as pkl
 from train import  Trainer,loss_function
 from torch import optim
 from evaluate import Evaluator
-import os,argparse
+import os,argparse,sys
 import torch
 # load configuration
 # load data
@@ -34,6 +34,21 @@ def parse():
      parser.add_argument('-ep','--eval_path',default='20.txt')
 
      parser.add_argument('-voc','--voc_path',default=None)
+
+     # classify: a classifier over the title and comment vectors; dual: dot product of the encoded vectors, see retrieval.py
+     parser.add_argument('-mm','--model_mode',default='classify',choices=MODES)
+     parser.add_argument('-ed','--encoding_dim',default=128,type=int)
+
+     # for compile: the binary datasets are saved in <compiled_dir>/train and <compiled_dir>/val
+     parser.add_argument('-cd','--compiled_dir',default='./compiled')
+
+     # batch the pairs of similar lengths together to cut the padding
+     parser.add_argument('--bucket',action='store_true')
+     # shuffle the training pairs and batches each epoch, the order is reproducible from the seed
+     parser.add_argument('--shuffle',action='store_true')
+     parser.add_argument('--seed',default=0,type=int)
+     # the number of batches prepared ahead on a background thread (eg. 4), 0 to prepare them on the training loop
+     parser.add_argument('-pf','--prefetch',default=0,type=int)
     
      args = parser.parse_args()
      return args
@@ -55,13 +70,19 @@ if arg.voc_path is not None:
     with open(arg.voc_path,'rb') as f:
         vocab = pkl.load(f)
 
+# compile the text datasets, then train with -tp=<compiled_dir>/train -vp=<compiled_dir>/val
+if arg.mode == 'compile':
+    vocab = compile_dataset(arg.train_path,os.path.join(arg.compiled_dir,'train'),vocab)
+    compile_dataset(arg.val_path,os.path.join(arg.compiled_dir,'val'),vocab)
+    sys.exit(0)
+
 if arg.mode == 'train':
     train_loader = DataLoader(vocab)
-    train_loader.load_all(arg.train_path,batch_size)
+    train_loader.load_all(arg.train_path,batch_size,arg.bucket,arg.shuffle,arg.seed)
     train_batch = train_loader.batch_data 
     vocab = train_loader.vocab
     val_loader = DataLoader(vocab)
-    val_loader.load_all(arg.val_path,batch_size)
+    val_loader.load_all(arg.val_path,batch_size,arg.bucket)
     val_batch = val_loader.batch_data 
 #elif arg.mode == 'test':
 #    eval_loader = DataLoader(vocab)
@@ -71,10 +92,10 @@ if arg.mode == 'train':
 
 embedding_dim,title_gru_units,response_gru_units = 200,128,256
 hyper_parameters = (vocab,embedding_dim,title_gru_units,\
-                 response_gru_units) 
+                 response_gru_units,arg.model_mode,arg.encoding_dim) 
 
 if arg.checkpoint_path is not None:
-    checkpoint = torch.load(arg.checkpoint_path)
+    checkpoint = torch.load(arg.checkpoint_path,weights_only=False)
     if 'model_hyper' in checkpoint:
         hyper_parameters = checkpoint['model_hyper']
     net =  PIXNETNET(*hyper_parameters)
@@ -92,6 +113,9 @@ def get_X_y(batch_data):
     batch_label,batch_title,batch_comment = batch_data
     X = BatchX(batch_title,batch_comment)
     y = batch_label
+    if arg.prefetch > 0:
+        prefetcher = Prefetcher(X,y,arg.prefetch)
+        return prefetcher.X,prefetcher.y
     return X,y
 
 if arg.mode == 'train':
@@ -9,25 +9,31 @@ device = get_device()
 #torch.set_printoptions(edgeitems=20)
 
 
+# the sequences can be in any order, the packed sequence sorts them by length and ht is unsorted back to the input order
+# so the title and the response of a pair stay in the same row
 def dynamic_rnn(rnn_cell,padded_sequences,seq_lens,h0s):
-    #print(seq_lens)
-    #seq_lens, perm_idx = seq_lens.sort(0, descending=True)
-    #print(perm_idx)
-    #padded_sequences =  padded_sequences[perm_idx]
-                                                          #seq length: type is not a tensor
-    packed_input = pack_padded_sequence(padded_sequences, seq_lens.data.cpu().numpy(),batch_first=True)
+                                                          #seq length: a cpu tensor
+    packed_input = pack_padded_sequence(padded_sequences, seq_lens.cpu(),batch_first=True,enforce_sorted=False)
     _ , ht = rnn_cell(packed_input,h0s)
-    # batch_first ... but output shape of ht is still (num_layer*seq_len,batch,featueres)
-    ht = torch.t(ht)
+    # batch_first ... but output shape of ht is still (num_layer*num_direction,batch,featueres)
+    ht = ht.transpose(0,1)
     ht = ht.contiguous() 
     return  ht
 
 
 
+# mode classify: the title and response vectors are concatenated into a 2-way classifier
+# mode dual: the title and response vectors are projected to encoding_dim and scored by dot product,
+#            so the responses can be encoded once offline, see retrieval.py
+MODES = ['classify','dual']
+
 class PIXNETNET(nn.Module):
     def __init__(self,vocab,embedding_dim,title_gru_units,\
-                 response_gru_units):
+                 response_gru_units,mode='classify',encoding_dim=128):
         super(PIXNETNET, self).__init__()
+        assert mode in MODES,mode
+        self.mode = mode
+        self.encoding_dim = encoding_dim
 
         self.embedding_dim = embedding_dim 
         self.vocab = vocab
@@ -42,9 +48,10 @@ class PIXNETNET(nn.Module):
 
         self.__build()
     
+    # the arguments of __init__, saved in the checkpoints
     def hyper_parameters(self):
-        return  self.vocab,self.embedding_dim,self.vocab,self.title_gru_units,\
-        self.response_gru_units,self.prediction_layer_dim 
+        return  self.vocab,self.embedding_dim,self.title_gru_units,\
+        self.response_gru_units,self.mode,self.encoding_dim
 
     def __build(self):
         self.embeddings = nn.Embedding(self.vocab_size, self.embedding_dim).to(device)
@@ -52,10 +59,16 @@ class PIXNETNET(nn.Module):
         self.title_gru = nn.GRU(self.embedding_dim, self.title_gru_units,bidirectional=True,batch_first=True).to(device)
         self.response_gru = nn.GRU(self.embedding_dim, self.response_gru_units,bidirectional=True,batch_first=True).to(device)
 
-        self.prediction_layer = nn.Linear(self.prediction_layer_dim,2).to(device)
+        if self.mode == 'dual':
+            self.title_projection = nn.Linear(self.title_gru_units,self.encoding_dim).to(device)
+            self.response_projection = nn.Linear(self.response_gru_units,self.encoding_dim).to(device)
+            nn.init.xavier_normal_(self.title_projection.weight)
+            nn.init.xavier_normal_(self.response_projection.weight)
+        else:
+            self.prediction_layer = nn.Linear(self.prediction_layer_dim,2).to(device)
+            nn.init.xavier_normal_(self.prediction_layer.weight)
 
         nn.init.xavier_normal_(self.embeddings.weight)
-        nn.init.xavier_normal_(self.prediction_layer.weight)
 
         self.init_gru(self.title_gru)
         self.init_gru(self.response_gru)
@@ -77,29 +90,62 @@ class PIXNETNET(nn.Module):
     #    title : title_tensor(N,MAX_TITLE_TOKEN_NUM of this batch), title_token_num(N)
     #    blogs : blogs  (N,MAX_TITLE_TOKEN_NUM),blog_token_num (N)
     #    response : .....
-    def forward(self,title,response):
-        batch_size = response[0].size(0)
- 
-
-        title_embedding = self.embeddings(title[0]) 
-        response_embedding = self.embeddings(response[0])
-
-
-        title_h0 = self.init_gru_state(batch_size,self.title_gru_units)  
-        response_h0 = self.init_gru_state(batch_size,self.response_gru_units)
-
-
-        # last time step output of each sequneces
-        title_vector = dynamic_rnn(self.title_gru,title_embedding,title[1],title_h0)
-        response_vector = dynamic_rnn(self.response_gru,response_embedding,response[1],response_h0)     
-        response_vector = response_vector[:,0,:]+response_vector[:,1,:]
-        title_vector = title_vector[:,0,:]+title_vector[:,1,:]
+    # last time step output of each sequneces, the two directions summed up
+    def encode(self,gru,gru_units,sentences):
+        batch_size = sentences[0].size(0)
+        embedding = self.embeddings(sentences[0])
+        h0 = self.init_gru_state(batch_size,gru_units)
+        vector = dynamic_rnn(gru,embedding,sentences[1],h0)
+        return vector[:,0,:]+vector[:,1,:]
+
+    # (N,title_gru_units), or (N,encoding_dim) in the dual mode
+    def encode_title(self,title):
+        vector = self.encode(self.title_gru,self.title_gru_units,title)
+        if self.mode == 'dual':
+            vector = self.title_projection(vector)
+        return vector
+
+    # (N,response_gru_units), or (N,encoding_dim) in the dual mode
+    def encode_response(self,response):
+        vector = self.encode(self.response_gru,self.response_gru_units,response)
+        if self.mode == 'dual':
+            vector = self.response_projection(vector)
+        return vector
+
+    # dual mode: the dot product of each pair of vectors
+    def score(self,title_vector,response_vector):
+        return (title_vector*response_vector).sum(1)
+
+    # 2-way scores of the pairs of encoded vectors
+    def logits(self,title_vector,response_vector):
+        if self.mode == 'dual':
+            # as (0,dot product), so log_softmax gives log sigmoid of the dot product for label 1
+            dot = self.score(title_vector,response_vector)
+            return torch.stack((torch.zeros_like(dot),dot),dim=1)
         concated_vector = torch.cat((title_vector,response_vector),dim=1)
-        score = self.prediction_layer(concated_vector)
+        return self.prediction_layer(concated_vector)
+
+    # title_index: the titles are the unique titles of the batch, response i is paired with title title_index[i]
+    def forward(self,title,response,title_index=None):
+        title_vector = self.encode_title(title)
+        if title_index is not None:
+            title_vector = title_vector[title_index]
+        response_vector = self.encode_response(response)
+        score = self.logits(title_vector,response_vector)
         p = torch.nn.functional.log_softmax(score,1)
         return p
 
 
+# a model saved by Trainer.train
+def load_model(checkpoint_path):
+    # the vocab is pickled in the hyper parameters
+    checkpoint = torch.load(checkpoint_path,map_location=device,weights_only=False)
+    model = PIXNETNET(*checkpoint['model_hyper'])
+    model.load_state_dict(checkpoint['model'])
+    model.eval()
+    return model
+
+
 
 
 
@@ -0,0 +1,157 @@
+import re
+import sqlite3
+import argparse
+from db_api import DB_FILE, DB_INDEXES
+
+DB_FILE2 = "wordDict.db"
+
+# Versioned schema migrations, the applied version is kept in PRAGMA user_version of each database.
+# Each migration is (version, description, statements), and should be safe to re-run.
+MIGRATIONS = {
+    "pixnet": [
+        (1, "Secondary indexes of keywords and tags",
+            ["CREATE INDEX IF NOT EXISTS " + name + " ON " + definition for name, definition in DB_INDEXES]),
+    ],
+    "wordDict": [
+        (1, "Indexes of the tf-idf tables",
+            ["CREATE INDEX IF NOT EXISTS idx_blogs_tf_idf_word ON blogs_tf_idf(word_id)",
+            "CREATE INDEX IF NOT EXISTS idx_blogs_tf_idf_rank ON blogs_tf_idf(blog_id, tf_idf)",
+            "CREATE INDEX IF NOT EXISTS idx_blogs_title_tf_idf_word ON blogs_title_tf_idf(word_id)",
+            "CREATE INDEX IF NOT EXISTS idx_comments_tf_idf_word ON comments_tf_idf(word_id)"]),
+    ],
+}
+
+# Queries on the hot path of the similar blogs retrieval, used to report the query plans.
+HOT_QUERIES = {
+    "pixnet": [
+        "SELECT * FROM comments WHERE blog_id = ?",
+        "SELECT * FROM keywords WHERE blog_id = ?",
+        "SELECT blog_id, COUNT(*) FROM keywords WHERE blog_id != ? AND keywords IN (SELECT keywords FROM keywords WHERE blog_id = ?) GROUP BY blog_id",
+        "SELECT blog_id, COUNT(*) FROM tags WHERE blog_id != ? AND tags IN (SELECT tags FROM tags WHERE blog_id = ?) GROUP BY blog_id",
+    ],
+    "wordDict": [
+        "SELECT word_id, tf_idf FROM blogs_tf_idf WHERE blog_id = ? ORDER BY tf_idf DESC LIMIT 10",
+        "SELECT word_id FROM blogs_tf_idf GROUP BY word_id",
+        "SELECT blog_id, word_id, tf_idf FROM blogs_title_tf_idf WHERE word_id = ?",
+    ],
+}
+
+def getVersion(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def setVersion(conn, version):
+    # PRAGMA does not accept parameters
+    conn.execute("PRAGMA user_version = " + str(int(version)))
+    conn.commit()
+
+def missingTables(conn, statements):
+    '''
+        Get the tables indexed by the statements which do not exist yet, eg. the tf-idf tables before WordDict.buildTFIDF.
+
+        Parameters
+        ====================================
+
+        conn        `sqlite3.Connection` - A SQLite connection object of the database.
+        statements  `list[str]` - The CREATE INDEX statements of a migration.
+
+        Returns
+        ====================================
+
+        `list[str]`  - The missing tables.
+    '''
+    tables = [m.group(1) for statement in statements for m in re.finditer(r"\bON\s+(\w+)", statement)]
+    existing = set(r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    return [table for table in dict.fromkeys(tables) if table not in existing]
+
+def migrate(conn, schema, target = None, analyze = True):
+    '''
+        Apply the pending migrations of a database.
+
+        Parameters
+        ====================================
+
+        conn    `sqlite3.Connection` - A SQLite connection object of the database.
+        schema  `str`   - "pixnet" or "wordDict", the key of MIGRATIONS.
+        target  `None|int`  - The version to migrate to, the latest if None is given.
+        analyze `bool`  - Whether to run ANALYZE after migrating, so that the query planner can use the new indexes.
+
+        Returns
+        ====================================
+
+        `int`   - The version of the database after migrating.
+
+        A migration whose tables do not exist yet is deferred with the later ones, the version is left unchanged so that it is applied by a later run.
+    '''
+    current = getVersion(conn)
+    cur = conn.cursor()
+    for version, description, statements in MIGRATIONS[schema]:
+        if version <= current or (target is not None and version > target):
+            continue
+        missing = missingTables(conn, statements)
+        if missing:
+            print("Migration - " + schema + " v" + str(version) + " - Deferred, missing tables: " + ", ".join(missing))
+            break
+        print("Migration - " + schema + " v" + str(version) + " - " + description)
+        for statement in statements:
+            cur.execute(statement)
+        conn.commit()
+        setVersion(conn, version)
+        current = version
+
+    if analyze:
+        print("Migration - " + schema + " - ANALYZE")
+        cur.execute("ANALYZE")
+        conn.commit()
+    return current
+
+def explainQueries(conn, schema, sampleID = 1):
+    '''
+        Get the query plans of the hot queries of a database.
+
+        Parameters
+        ====================================
+
+        conn        `sqlite3.Connection` - A SQLite connection object of the database.
+        schema      `str`   - "pixnet" or "wordDict", the key of HOT_QUERIES.
+        sampleID    `int`   - The id bound to the query parameters.
+
+        Returns
+        ====================================
+
+        `list[tuple(str, list[str])]`  - (query, plan details) of each query.
+    '''
+    plans = []
+    for query in HOT_QUERIES[schema]:
+        try:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + query, [sampleID] * query.count("?")).fetchall()
+            plans.append((query, [r[-1] for r in rows]))
+        except sqlite3.OperationalError as e:
+            plans.append((query, ["(skipped: " + str(e) + ")"]))
+    return plans
+
+def printPlans(plans, header):
+    print(header)
+    for query, details in plans:
+        print("  " + query)
+        for detail in details:
+            print("    " + detail)
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Migrate the schema of pixnet.db and wordDict.db')
+    parser.add_argument('-db', '--db_path', default=DB_FILE)
+    parser.add_argument('-wd', '--word_dict_path', default=DB_FILE2)
+    parser.add_argument('-t', '--target', default=None, type=int)
+    parser.add_argument('--explain', action='store_true', help='report the query plans before and after migrating')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arg = parse()
+    for schema, path in [("pixnet", arg.db_path), ("wordDict", arg.word_dict_path)]:
+        connection = sqlite3.connect(path)
+        if arg.explain:
+            printPlans(explainQueries(connection, schema), "Query plans before (" + path + ", v" + str(getVersion(connection)) + ")")
+        version = migrate(connection, schema, arg.target)
+        if arg.explain:
+            printPlans(explainQueries(connection, schema), "Query plans after (" + path + ", v" + str(version) + ")")
+        connection.close()
@@ -0,0 +1,206 @@
+import os
+import random
+import sqlite3
+import numpy as np
+
+DB_FILE = "pixnet.db"
+FETCH_ROWS = 100000
+
+class NegativeSampler():
+    '''
+        Sampler of the comments not in a blog, over the comment keys loaded once into numpy arrays sorted by blog_id.
+    '''
+    def __init__(self, rowIDs, blogColumn, commentColumn):
+        '''
+            Create a NegativeSampler object, typically by NegativeSampler.build or NegativeSampler.load.
+
+            Parameters
+            ====================================
+
+            rowIDs          `np.ndarray`    - The rowid of each comment in the comments table.
+            blogColumn      `np.ndarray`    - The sorted blog_id of each comment.
+            commentColumn   `np.ndarray`    - The comment_id of each comment.
+        '''
+        self.rowIDs = rowIDs
+        self.blogColumn = blogColumn
+        self.commentColumn = commentColumn
+
+    def size(self):
+        return len(self.rowIDs)
+
+    def getRange(self, blog_id):
+        '''
+            Get the positions of the comments of a blog, the comments are contiguous as the keys are sorted by blog_id.
+
+            Parameters
+            ====================================
+
+            blog_id     `int`   - The blog_id.
+
+            Returns
+            ====================================
+
+            `tuple(int, int)`  - (start, end) positions, empty if the blog has no comments.
+        '''
+        return int(np.searchsorted(self.blogColumn, blog_id, "left")), int(np.searchsorted(self.blogColumn, blog_id, "right"))
+
+    def sample(self, blog_id, retreiveCount = 5, rng = None, similarBlogIDs = None, hardRatio = 0.5):
+        '''
+            Draw the positions of comments not in a blog without replacement, in O(retreiveCount).
+            The positions are drawn from the keys without the blog's range and the hard negatives, then shifted over each of them.
+
+            Parameters
+            ====================================
+
+            blog_id         `int`   - The blog_id to exclude.
+            retreiveCount   `int`   - The number of comments.
+            rng             `random.Random|np.random.Generator` - The random generator. Default as a new unseeded generator.
+            similarBlogIDs  `None|list[int]`    - Blogs to draw hard negatives from, eg. from Blog.getSimilarBlogs.
+            hardRatio       `float` - The ratio of the comments drawn from similarBlogIDs, the rest are drawn from all the other blogs.
+
+            Returns
+            ====================================
+
+            `np.ndarray`  - The positions of the sampled comments, fewer than retreiveCount only if the other blogs have fewer comments.
+        '''
+        if isinstance(rng, random.Random):
+            rng = np.random.default_rng(rng.getrandbits(64))
+        elif rng is None:
+            rng = np.random.default_rng()
+        start, end = self.getRange(blog_id)
+
+        hard = np.zeros(0, dtype=np.int64)
+        if similarBlogIDs:
+            ranges = [self.getRange(bi) for bi in dict.fromkeys(similarBlogIDs) if bi != blog_id]
+            candidates = np.concatenate([np.arange(s, e, dtype=np.int64) for s, e in ranges]) if ranges else hard
+            hard = rng.choice(candidates, min(len(candidates), int(round(retreiveCount * hardRatio))), replace=False)
+
+        # The excluded blocks sorted by position: the blog's range and each hard negative
+        blockStarts = np.append(hard, start)
+        blockLengths = np.append(np.ones(len(hard), dtype=np.int64), end - start)
+        order = np.argsort(blockStarts, kind="stable")
+        blockStarts, blockLengths = blockStarts[order], blockLengths[order]
+        shifts = np.cumsum(blockLengths)
+        # A drawn position is shifted over every block with fewer other positions before it
+        freeBefore = blockStarts - (shifts - blockLengths)
+
+        others = self.size() - (end - start) - len(hard)
+        positions = rng.choice(others, min(others, retreiveCount - len(hard)), replace=False).astype(np.int64)
+        positions += np.append(0, shifts)[np.searchsorted(freeBefore, positions, "right")]
+        return np.concatenate([hard, positions])
+
+    def sampleRows(self, blog, retreiveCount = 5, rng = None, mode = "random", hardRatio = 0.5, similarArgs = None):
+        '''
+            Sample the comment rows not in a blog.
+
+            Parameters
+            ====================================
+
+            blog            `Blog`  - The blog to exclude, an api.Blog for the "hard" mode.
+            retreiveCount   `int`   - The number of comments.
+            rng             `random.Random` - The random generator. Default as a new unseeded generator.
+            mode            `str`   - "random": comments of any other blogs; "hard": a hardRatio of the comments from the blogs of blog.getSimilarBlogs.
+            hardRatio       `float` - See sample.
+            similarArgs     `dict`  - The keyword arguments of blog.getSimilarBlogs, eg. conn2 and keywordIndex.
+
+            Returns
+            ====================================
+
+            `list[tuple]`  - The rows of the comments table, in the sampled order.
+        '''
+        similarBlogIDs = None
+        if mode == "hard":
+            if not hasattr(blog, "getSimilarBlogs"):
+                raise ValueError("The hard mode needs an api.Blog which has getSimilarBlogs.")
+            similarArgs = {"finalRetreiveCount": 10, **(similarArgs or {})}
+            similarBlogIDs = [b.blog_id for b in blog.getSimilarBlogs(rng = rng, **similarArgs)]
+        elif mode != "random":
+            raise ValueError("Unknown mode: " + str(mode))
+        return self.fetchRows(blog.conn, self.rowIDs[self.sample(blog.blog_id, retreiveCount, rng, similarBlogIDs, hardRatio)].tolist())
+
+    @staticmethod
+    def fetchRows(conn, rowIDs):
+        '''
+            Get the comment rows by rowid.
+
+            Parameters
+            ====================================
+
+            conn    `sqlite3.Connection` - A SQLite connection object.
+            rowIDs  `list[int]` - The rowids.
+
+            Returns
+            ====================================
+
+            `list[tuple]`  - The rows in the order of rowIDs, the deleted rows are skipped.
+        '''
+        if len(rowIDs) == 0:
+            return []
+        cur = conn.cursor()
+        cur.execute("SELECT rowid, * FROM comments WHERE rowid IN (" + ",".join(["?"] * len(rowIDs)) + ")", rowIDs)
+        rows = {r[0]: r[1:] for r in cur.fetchall()}
+        return [rows[rowID] for rowID in rowIDs if rowID in rows]
+
+    def save(self, folder):
+        '''
+            Save the keys into a folder, the arrays can be memory-mapped by NegativeSampler.load.
+
+            Parameters
+            ====================================
+
+            folder  `str`   - The folder to save the keys.
+        '''
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in ["rowIDs", "blogColumn", "commentColumn"]:
+            np.save(os.path.join(folder, name + ".npy"), getattr(self, name))
+
+    @staticmethod
+    def load(folder, mmap = True):
+        '''
+            Load the keys saved by NegativeSampler.save.
+
+            Parameters
+            ====================================
+
+            folder  `str`   - The folder of the keys.
+            mmap    `bool`  - Whether to memory-map the arrays instead of reading them into memory.
+
+            Returns
+            ====================================
+
+            `NegativeSampler`  - The sampler.
+        '''
+        return NegativeSampler(**{name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r" if mmap else None)
+                                    for name in ["rowIDs", "blogColumn", "commentColumn"]})
+
+    @staticmethod
+    def build(conn = sqlite3.connect(DB_FILE)):
+        '''
+            Load the keys of the comments table.
+
+            Parameters
+            ====================================
+
+            conn    `sqlite3.Connection` - A SQLite connection object. Default as the a new connection to the global DB_FILE databse file.
+
+            Returns
+            ====================================
+
+            `NegativeSampler`  - The sampler.
+        '''
+        cur = conn.cursor()
+        cur.execute("SELECT rowid, blog_id, comment_id FROM comments")
+
+        # Fetch by chunks to avoid holding the whole table as python tuples
+        chunks = []
+        while True:
+            rows = cur.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+        keys = np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.int64)
+
+        order = np.argsort(keys[:, 1], kind="stable")
+        keys = keys[order]
+        return NegativeSampler(keys[:, 0].copy(), keys[:, 1].astype(np.int32), keys[:, 2].astype(np.int32))
@@ -0,0 +1,100 @@
+import sys,argparse
+from collections import OrderedDict
+import numpy as np
+import torch
+from data import DB_FILE,connect_readonly
+from match import load_model,device
+from retrieval import ENCODE_BATCH_SIZE,to_sentences,encode_sentences
+from segmenter import disable_cache
+
+TITLE_CACHE_SIZE = 1024
+
+# 給一篇文章排序候選回覆: score the candidate comments of a blog with PIXNETNET
+# the title is segmented and encoded once per request (and kept in a small cache), the candidates are encoded in batches of similar lengths
+class Ranker():
+    def __init__(self,model,db_path=DB_FILE,batch_size=ENCODE_BATCH_SIZE,title_cache_size=TITLE_CACHE_SIZE):
+        self.model = model.eval()
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.title_cache_size = title_cache_size
+        self.title_cache = OrderedDict()
+
+    @staticmethod
+    def from_checkpoint(checkpoint_path,db_path=DB_FILE,batch_size=ENCODE_BATCH_SIZE):
+        return Ranker(load_model(checkpoint_path),db_path,batch_size)
+
+    # blog: a blog_id, or the title text
+    def title_of(self,blog):
+        if isinstance(blog,str):
+            return blog
+        conn = connect_readonly(self.db_path)
+        row = conn.execute('SELECT title FROM blogs WHERE blog_id = ?',(int(blog),)).fetchone()
+        conn.close()
+        if row is None:
+            raise KeyError('blog %s is not in %s'%(blog,self.db_path))
+        return row[0] or ''
+
+    # (1,dim) vector of the title
+    def encode_title(self,title):
+        if title in self.title_cache:
+            self.title_cache.move_to_end(title)
+            return self.title_cache[title]
+        sentence = to_sentences([title],self.model.vocab)[0]
+        with torch.inference_mode():
+            tokens = torch.tensor([sentence.tokens],dtype=torch.int64,device=device)
+            vector = self.model.encode_title((tokens,torch.tensor([sentence.length()])))
+        self.title_cache[title] = vector
+        if len(self.title_cache) > self.title_cache_size:
+            self.title_cache.popitem(last=False)
+        return vector
+
+    # the probability of each comment being a reply of the blog, in the order of comments
+    def score(self,blog,comments):
+        return self.score_many([(blog,comments)])[0]
+
+    # requests: (blog,comments) pairs, the comments of all the requests are encoded together
+    # return: the scores of each request
+    def score_many(self,requests):
+        counts = [len(comments) for _,comments in requests]
+        if sum(counts) == 0:
+            return [np.zeros(0,dtype=np.float32) for _ in requests]
+        title_vectors = torch.cat([self.encode_title(self.title_of(blog)) for blog,_ in requests])
+        comments = [comment for _,request_comments in requests for comment in request_comments]
+        response_vectors = encode_sentences(self.model.encode_response,to_sentences(comments,self.model.vocab),self.batch_size)
+        with torch.inference_mode():
+            title_index = torch.from_numpy(np.repeat(np.arange(len(requests)),counts)).to(device)
+            logits = self.model.logits(title_vectors[title_index],torch.from_numpy(response_vectors).to(device))
+            scores = torch.softmax(logits,1)[:,1].cpu().numpy()
+        return np.split(scores,np.cumsum(counts)[:-1])
+
+    # (index in comments,comment,score) by descending score
+    def rank(self,blog,comments):
+        scores = self.score(blog,comments)
+        order = np.argsort(-scores,kind='stable')
+        return [(int(i),comments[i],float(scores[i])) for i in order]
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='rank the candidate comments of a blog')
+    parser.add_argument('-cpp','--checkpoint_path',required=True)
+    parser.add_argument('-db','--db_path',default=DB_FILE)
+    blog = parser.add_mutually_exclusive_group(required=True)
+    blog.add_argument('-b','--blog_id',default=None,type=int)
+    blog.add_argument('-t','--title',default=None)
+    # one candidate comment per line
+    parser.add_argument('-c','--candidates_path',required=True)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arg = parse()
+    with open(arg.candidates_path,'r',encoding='utf-8') as f:
+        candidates = [line.rstrip('\n') for line in f if line.strip()]
+    # the candidates are one-off texts, do not store them in the segment cache file
+    disable_cache()
+    ranker = Ranker.from_checkpoint(arg.checkpoint_path,arg.db_path)
+    try:
+        ranked = ranker.rank(arg.title if arg.blog_id is None else arg.blog_id,candidates)
+    except KeyError as e:
+        sys.exit('ranker.py: error: %s'%(e.args[0]))
+    for i,comment,score in ranked:
+        print('%.4f\t%d\t%s'%(score,i,comment))
@@ -0,0 +1,153 @@
+import os,json,argparse
+import numpy as np
+import torch
+from data import DB_FILE,Sentence,flatten_sentences,collate_tokens,preprocessing_blog_texts,connect_readonly
+from match import load_model,device
+from ann import REFINE_FACTOR
+
+ENCODE_BATCH_SIZE = 256
+BANK_CHUNK_ROWS = 10000
+SCORE_CHUNK_ROWS = 100000
+
+# the sentences of the texts, segmented as the training data
+def to_sentences(texts,vocab):
+    return [Sentence(text,vocab) for text in preprocessing_blog_texts([text or '' for text in texts])]
+
+# encode the sentences in batches of similar lengths, the vectors are in the order of the sentences
+# encode: model.encode_title or model.encode_response
+def encode_sentences(encode,sentences,batch_size=ENCODE_BATCH_SIZE):
+    tokens,offsets = flatten_sentences(sentences)
+    order = np.argsort(-np.diff(offsets),kind='stable')
+    vectors = []
+    with torch.inference_mode():
+        for start in range(0,len(order),batch_size):
+            padded,lens = collate_tokens(tokens,offsets,order[start:start+batch_size])
+            vector = encode((torch.from_numpy(padded).to(device),torch.from_numpy(lens)))
+            vectors.append(vector.float().cpu().numpy())
+    if not vectors:
+        return np.zeros((0,0),dtype=np.float32)
+    vectors = np.concatenate(vectors)
+    unsorted = np.empty_like(vectors)
+    unsorted[order] = vectors
+    return unsorted
+
+def encode_titles(model,titles):
+    return encode_sentences(model.encode_title,to_sentences(titles,model.vocab))
+
+def encode_responses(model,responses):
+    return encode_sentences(model.encode_response,to_sentences(responses,model.vocab))
+
+
+# 離線把所有回覆編碼: every comment of the comments table encoded once by a dual mode model
+# saved as embeddings.npy (N,encoding_dim) float32/float16, blog_ids.npy, comment_ids.npy and meta.json
+def build_comment_bank(model,save_dir,db_path=DB_FILE,dtype='float16',chunk_rows=BANK_CHUNK_ROWS):
+    if model.mode != 'dual':
+        raise ValueError('the comment bank needs a dual mode model, got %s'%(model.mode))
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    conn = connect_readonly(db_path)
+    cur = conn.cursor()
+    # one read transaction, so the count and the rows are of the same snapshot
+    cur.execute('BEGIN')
+    count = cur.execute('SELECT COUNT(*) FROM comments').fetchone()[0]
+    embeddings = np.lib.format.open_memmap(os.path.join(save_dir,'embeddings.npy'),mode='w+',dtype=dtype,shape=(count,model.encoding_dim))
+    blog_ids = np.zeros(count,dtype=np.int64)
+    comment_ids = np.zeros(count,dtype=np.int64)
+
+    cur.execute('SELECT blog_id,comment_id,comments FROM comments ORDER BY blog_id,comment_id')
+    position = 0
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if not rows:
+            break
+        end = position+len(rows)
+        blog_ids[position:end] = [row[0] for row in rows]
+        comment_ids[position:end] = [row[1] for row in rows]
+        embeddings[position:end] = encode_responses(model,[row[2] for row in rows])
+        position = end
+        print('encoded %d/%d comments'%(position,count))
+    conn.close()
+
+    embeddings.flush()
+    del embeddings
+    np.save(os.path.join(save_dir,'blog_ids.npy'),blog_ids)
+    np.save(os.path.join(save_dir,'comment_ids.npy'),comment_ids)
+    with open(os.path.join(save_dir,'meta.json'),'w') as f:
+        json.dump({'rows':count,'dim':model.encoding_dim,'dtype':dtype},f)
+    return CommentBank(save_dir)
+
+
+class CommentBank():
+    def __init__(self,save_dir,mmap=True):
+        with open(os.path.join(save_dir,'meta.json'),'r') as f:
+            self.meta = json.load(f)
+        mode = 'r' if mmap else None
+        for name in ['embeddings','blog_ids','comment_ids']:
+            setattr(self,name,np.load(os.path.join(save_dir,'%s.npy'%(name)),mmap_mode=mode))
+
+    def __len__(self):
+        return self.meta['rows']
+
+    # the dot products of the title vectors (Q,dim) with the comments [start,end), in float32
+    def score(self,title_vectors,start=0,end=None):
+        title_vectors = np.atleast_2d(np.asarray(title_vectors,dtype=np.float32))
+        return title_vectors @ np.asarray(self.embeddings[start:end],dtype=np.float32).T
+
+    # the k best comments of each title vector, by chunks of the bank so the scores of all the comments are never held
+    # exclude_blog_ids: a blog_id per title whose comments are skipped, eg. to retrieve from the other blogs
+    # return: bank indices (Q,k) and scores (Q,k) sorted by descending score
+    def top_k(self,title_vectors,k=10,exclude_blog_ids=None,chunk_rows=SCORE_CHUNK_ROWS):
+        title_vectors = np.atleast_2d(np.asarray(title_vectors,dtype=np.float32))
+        k = min(k,len(self))
+        best_idx = np.zeros((len(title_vectors),0),dtype=np.int64)
+        best_scores = np.zeros((len(title_vectors),0),dtype=np.float32)
+        for start in range(0,len(self),chunk_rows):
+            end = min(start+chunk_rows,len(self))
+            scores = self.score(title_vectors,start,end)
+            if exclude_blog_ids is not None:
+                excluded = np.asarray(self.blog_ids[start:end])[None,:] == np.asarray(exclude_blog_ids)[:,None]
+                scores[excluded] = -np.inf
+            idx = np.concatenate([best_idx,np.broadcast_to(np.arange(start,end),scores.shape)],axis=1)
+            scores = np.concatenate([best_scores,scores],axis=1)
+            top = np.argpartition(-scores,k-1,axis=1)[:,:k]
+            best_idx,best_scores = np.take_along_axis(idx,top,1),np.take_along_axis(scores,top,1)
+        order = np.argsort(-best_scores,axis=1,kind='stable')
+        return np.take_along_axis(best_idx,order,1),np.take_along_axis(best_scores,order,1)
+
+    # the (blog_id,comment_id,score) of the k best comments of each title
+    # index: an ann.IVFIndex of the embeddings to search approximately instead of scoring the whole bank,
+    #        a PQ index re-scores refine times the fetched candidates exactly with the embeddings,
+    #        the comments of exclude_blog_ids are then dropped from its results
+    def retrieve(self,model,titles,k=10,exclude_blog_ids=None,index=None,nprobe=8,refine=REFINE_FACTOR):
+        title_vectors = encode_titles(model,titles)
+        if index is None:
+            idx,scores = self.top_k(title_vectors,k,exclude_blog_ids)
+        else:
+            # the excluded comments can take up the top results, fetch as many more as the largest excluded blog has
+            # (the bank is sorted by blog_id, so the comments of a blog are contiguous)
+            fetch = k
+            if exclude_blog_ids is not None:
+                exclude_blog_ids = np.asarray(exclude_blog_ids)
+                counts = np.searchsorted(self.blog_ids,exclude_blog_ids,'right')-np.searchsorted(self.blog_ids,exclude_blog_ids,'left')
+                fetch += int(counts.max(initial=0))
+            idx,scores = index.search(title_vectors,fetch,nprobe,rerank_vectors=self.embeddings,refine=refine)
+            if exclude_blog_ids is not None:
+                excluded = (idx >= 0) & (np.asarray(self.blog_ids)[np.maximum(idx,0)] == exclude_blog_ids[:,None])
+                scores[excluded] = -np.inf
+                top = np.argsort(-scores,axis=1,kind='stable')[:,:k]
+                idx,scores = np.take_along_axis(idx,top,1),np.take_along_axis(scores,top,1)
+        return [[(int(self.blog_ids[i]),int(self.comment_ids[i]),float(s)) for i,s in zip(row_idx,row_scores) if s > -np.inf]
+                for row_idx,row_scores in zip(idx,scores)]
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='encode the comments into an embedding bank')
+    parser.add_argument('-cpp','--checkpoint_path',required=True)
+    parser.add_argument('-db','--db_path',default=DB_FILE)
+    parser.add_argument('-o','--output_dir',default='./comment_bank')
+    parser.add_argument('--dtype',default='float16',choices=['float16','float32'])
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arg = parse()
+    build_comment_bank(load_model(arg.checkpoint_path),arg.output_dir,arg.db_path,arg.dtype)
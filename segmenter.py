@@ -0,0 +1,389 @@
+import os
+import re
+import json
+import atexit
+import sqlite3
+import hashlib
+import functools
+import jieba
+from multiprocessing import Pool, current_process
+from bs4 import BeautifulSoup, Comment
+
+# Texts per task sent to a worker, large enough to amortize the IPC of each task
+CHUNK_SIZE = 64
+
+# Segment in the current process when there are fewer texts than this, the IPC costs more than the segmentation
+MIN_PARALLEL_TEXTS = 2 * CHUNK_SIZE
+
+CACHE_FILE = "segmentCache.db"
+
+# Hashes in one SELECT, below the SQLite variable limit
+CACHE_QUERY_SIZE = 500
+
+def trim_illegal_char(text):
+    res = re.findall(r'[\u4e00-\u9fffa-zA-Z0-9 \t]+',text)
+    trimmed = "".join(res)
+    return trimmed
+
+def remove_invalid(string):
+    '''
+        Remove numbers, emails, URLs.
+
+        Parameters
+        ====================================
+
+        string  `str`   - The text to be cleaned.
+
+        Returns
+        ====================================
+
+        `str`   - The string withought numbers, emails, URLs.
+    '''
+    return re.sub("\r|[0-9.]+|([-a-zA-Z0-9.`?{}]+@\w+\.\w+)|(((http|https):\/\/[\w\-_]+(\.[\w\-_]+)+([\w\-\.,@?^=%&amp;:/~\+#]*[\w\-\@?^=%&amp;/~\+#])?)?)", "",string)
+
+def segment_text(text, seg_type = 2):
+    '''
+        Segment the incoming text into Chinese and English words.
+
+        Parameters
+        ====================================
+
+        text        `str`   - The text to be segmented
+        seg_type    `int`   - 0: by characters; 1: by characters, but remove english words; 2: by jieba; 3: by jieba on the text trimmed by trim_illegal_char, as data.preprocessing_blog_text
+
+        Returns
+        ====================================
+
+        `list[str]`   - Segmented text in a list.
+    '''
+    if (seg_type == 3):
+        return [*jieba.cut(trim_illegal_char(text), cut_all=False)]
+
+    # Decompose HTML if needed
+    if (re.search("<.+>", text)):
+        text = re.sub("\n+", "\n", "".join([s for s in BeautifulSoup(text, "html.parser").find_all(string=True) if (s.parent.name not in ["script", "style", "select", "option"] and not isinstance(s, Comment))]))
+
+    # Skip English and Numbers if needed
+    if (seg_type == 1):
+        text = re.sub("[0-9a-zA-Z]","",text)
+
+    # Use jieba to perform word segmentation
+    if (seg_type == 2):
+        words = [*jieba.cut(text, cut_all=False)]
+
+    # OR split all the characters
+    elif (seg_type == 0 or seg_type == 1):
+        words = [*remove_invalid(text)]
+
+        # Replace the split english characters with a grouped word
+        if (len(words) > 1):
+            startEng = [*filter(lambda c: re.match("[a-zA-Z\']",c[1]) and (c[0]==0 or re.match("[a-zA-Z]",words[c[0]-1]) is None), enumerate(words))]
+            endEng = [*filter(lambda c: re.match("[a-zA-Z\']",c[1]) and (c[0]==(len(words)-1) or re.match("[a-zA-Z]",words[c[0]+1]) is None), enumerate(words))]
+        else:
+            startEng = []
+            endEng = []
+        replaceEle = zip([s[0] for s in startEng], [e[0]+1 for e in endEng])
+        accLen = 0
+        for r in replaceEle:
+            start = r[0] - accLen
+            end = r[1] - accLen
+            words[start] = "".join(words[start:end])
+            words[start+1:] = words[end:]
+            accLen += end-start-1
+
+    return words
+
+
+def dictionary_version():
+    '''
+        Get a version string of the jieba dictionary in use, which is a part of the cache key.
+        Words added by jieba.load_userdict / jieba.add_word are not detected, give a dict_version to SegmentCache for them.
+
+        Returns
+        ====================================
+
+        `str`   - The jieba version and the sha1 of the dictionary file.
+    '''
+    with jieba.dt.get_dict_file() as f:
+        return jieba.__version__ + ":" + hashlib.sha1(f.read()).hexdigest()
+
+
+class SegmentCache():
+    '''
+        Persistent cache of the segmented texts in a SQLite file, keyed by (sha1 of the text, seg_type, jieba dictionary version).
+    '''
+    def __init__(self, path = CACHE_FILE, dict_version = None):
+        '''
+            Create a SegmentCache object, the file is opened on the first use.
+
+            Parameters
+            ====================================
+
+            path            `str`   - The path of the SQLite file.
+            dict_version    `None|str`  - The dictionary version in the key. Default as dictionary_version().
+        '''
+        self.path = path
+        self.dict_version = dict_version
+        self.conn = None
+        self.pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        # A connection cannot be shared with forked processes, reconnect in each process
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout = 60)
+            self.pid = os.getpid()
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS segments
+                        (hash           BLOB,
+                        seg_type        INTEGER,
+                        dict_version    TEXT,
+                        words           TEXT,
+                        PRIMARY KEY(hash, seg_type, dict_version)) WITHOUT ROWID''')
+            self.conn.commit()
+            if self.dict_version is None:
+                self.dict_version = dictionary_version()
+        return self.conn
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def get_many(self, texts, seg_type):
+        '''
+            Look up the segmented words of the texts.
+
+            Parameters
+            ====================================
+
+            texts       `list[str]` - The texts.
+            seg_type    `int`   - See segment_text.
+
+            Returns
+            ====================================
+
+            `list[None|list[str]]`  - The segmented words of each text, None if it is not cached.
+        '''
+        conn = self.connect()
+        hashes = [SegmentCache.text_hash(text) for text in texts]
+        found = {}
+        distinct = list(set(hashes))
+        for start in range(0, len(distinct), CACHE_QUERY_SIZE):
+            batch = distinct[start:start + CACHE_QUERY_SIZE]
+            rows = conn.execute("SELECT hash, words FROM segments WHERE seg_type = ? AND dict_version = ? AND hash IN (" + ",".join(["?"] * len(batch)) + ")",
+                                [seg_type, self.dict_version] + batch).fetchall()
+            found.update(rows)
+        results = [json.loads(found[h]) if h in found else None for h in hashes]
+        hits = sum([1 for h in hashes if h in found])
+        self.hits += hits
+        self.misses += len(hashes) - hits
+        return results
+
+    def put_many(self, pairs, seg_type):
+        '''
+            Store the segmented words of the texts.
+
+            Parameters
+            ====================================
+
+            pairs       `iterable(tuple(str, list[str]))`   - (text, segmented words) pairs.
+            seg_type    `int`   - See segment_text.
+        '''
+        conn = self.connect()
+        conn.executemany("INSERT OR IGNORE INTO segments VALUES(?, ?, ?, ?)",
+                        [(SegmentCache.text_hash(text), seg_type, self.dict_version, json.dumps(words, ensure_ascii=False)) for text, words in pairs])
+        conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total > 0 else 0.0}
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn = None
+
+
+class Segmenter():
+    '''
+        Batch segmentation in a pool of worker processes with jieba initialized once per worker.
+    '''
+    def __init__(self, seg_type = 2, workers = None, chunk_size = CHUNK_SIZE, min_parallel = MIN_PARALLEL_TEXTS, cache = None):
+        '''
+            Create a Segmenter object, the pool is started on the first large batch.
+
+            Parameters
+            ====================================
+
+            seg_type        `int`   - See segment_text.
+            workers         `int`   - The number of worker processes, segment in the current process if 1 is given. Default as the cpu count. Always 1 in a daemon process (eg. a pool worker) which cannot have children.
+            chunk_size      `int`   - The number of texts sent to a worker in one task.
+            min_parallel    `int`   - Segment in the current process when a batch has fewer texts.
+            cache           `None|SegmentCache` - The cache to look up before segmenting, eg. get_cache().
+        '''
+        self.seg_type = seg_type
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.pool = None
+        self.pid = None
+        self.cache = cache
+        self.func = functools.partial(segment_text, seg_type = seg_type)
+
+    def worker_count(self):
+        # Checked on each use, a shared segmenter is inherited by the forked processes, eg. the pool workers of generate_shard
+        if current_process().daemon:
+            return 1
+        return self.workers or os.cpu_count()
+
+    def get_pool(self):
+        # A pool cannot be shared with forked processes, start a new one in each process
+        if self.pool is None or self.pid != os.getpid():
+            self.pool = Pool(self.worker_count(), initializer = jieba.initialize)
+            self.pid = os.getpid()
+        return self.pool
+
+    def segment(self, text):
+        if self.cache is None:
+            return self.func(text)
+        return self.segment_many([text])[0]
+
+    def segment_many(self, texts):
+        '''
+            Segment a batch of texts.
+
+            Parameters
+            ====================================
+
+            texts   `list[str]` - The texts.
+
+            Returns
+            ====================================
+
+            `list[list[str]]`   - The segmented words of each text, in the same order as texts.
+        '''
+        if self.cache is None:
+            return self.segment_uncached(texts)
+
+        # Only segment the distinct texts missing in the cache
+        results = self.cache.get_many(texts, self.seg_type)
+        missing = list(dict.fromkeys([text for text, words in zip(texts, results) if words is None]))
+        if missing:
+            segmented = dict(zip(missing, self.segment_uncached(missing)))
+            self.cache.put_many(segmented.items(), self.seg_type)
+            results = [segmented[text] if words is None else words for text, words in zip(texts, results)]
+        return results
+
+    def segment_uncached(self, texts):
+        if self.worker_count() <= 1 or len(texts) < self.min_parallel:
+            return [self.func(text) for text in texts]
+        return self.get_pool().map(self.func, texts, chunksize = self.chunk_size)
+
+    def iter_segment_many(self, texts):
+        '''
+            Segment an iterable of texts lazily, keeping the order, see segment_many.
+
+            Parameters
+            ====================================
+
+            texts   `iterable(str)` - The texts.
+
+            Returns
+            ====================================
+
+            `generator(list[str])`  - The segmented words of each text.
+        '''
+        if self.cache is not None:
+            return self.iter_batches(texts)
+        if self.worker_count() <= 1:
+            return (self.func(text) for text in texts)
+        return self.get_pool().imap(self.func, texts, chunksize = self.chunk_size)
+
+    def iter_batches(self, texts):
+        # The cache is looked up by batches of texts
+        batch = []
+        batch_size = self.chunk_size * self.worker_count() * 4
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                yield from self.segment_many(batch)
+                batch = []
+        yield from self.segment_many(batch)
+
+    def close(self):
+        if self.pool is not None and self.pid == os.getpid():
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Shared segmenters of the current process, one per seg_type, and their cache
+_segmenters = {}
+_cache = {"enabled": True, "path": CACHE_FILE, "cache": None}
+
+def enable_cache(path = CACHE_FILE):
+    '''
+        Use a cache file for the shared segmenters and the segmenters created with get_cache(). The cache is enabled by default.
+
+        Parameters
+        ====================================
+
+        path    `str`   - The path of the SQLite file.
+    '''
+    disable_cache()
+    _cache["enabled"] = True
+    _cache["path"] = path
+
+def disable_cache():
+    if _cache["cache"] is not None:
+        _cache["cache"].close()
+    _cache.update(enabled = False, cache = None)
+    for segmenter in _segmenters.values():
+        segmenter.cache = None
+
+def get_cache():
+    '''
+        Get the shared SegmentCache of the current process.
+
+        Returns
+        ====================================
+
+        `None|SegmentCache`   - The cache, None if it is disabled.
+    '''
+    if _cache["enabled"] and _cache["cache"] is None:
+        _cache["cache"] = SegmentCache(_cache["path"])
+    return _cache["cache"]
+
+def get_segmenter(seg_type = 2):
+    '''
+        Get the shared Segmenter of a seg_type, the pool is kept until the process exits.
+
+        Parameters
+        ====================================
+
+        seg_type    `int`   - See segment_text.
+
+        Returns
+        ====================================
+
+        `Segmenter`   - The shared segmenter.
+    '''
+    if seg_type not in _segmenters:
+        _segmenters[seg_type] = Segmenter(seg_type)
+    _segmenters[seg_type].cache = get_cache()
+    return _segmenters[seg_type]
+
+@atexit.register
+def close_segmenters():
+    for segmenter in _segmenters.values():
+        segmenter.close()
+    if _cache["cache"] is not None:
+        _cache["cache"].close()
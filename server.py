@@ -0,0 +1,208 @@
+import json,time,asyncio,argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from data import DB_FILE,preprocessing_blog_texts
+from ranker import Ranker
+from segmenter import disable_cache
+
+MAX_BATCH_PAIRS = 512
+MAX_LATENCY_MS = 5
+MAX_BODY_BYTES = 1024*1024
+# the latencies and batch sizes of the last requests for the metrics
+METRICS_WINDOW = 10000
+STATUS_TEXT = {200:'OK',400:'Bad Request',404:'Not Found',413:'Payload Too Large',500:'Internal Server Error'}
+
+class BadRequest(Exception):
+    pass
+
+class PendingRequest():
+    def __init__(self,blog,comments,future):
+        self.blog = blog
+        self.comments = comments
+        self.future = future
+
+
+# 本地評分服務: POST /score and /rank with {"blog_id":..} or {"title":..} and {"comments":[..]}, GET /metrics
+# the concurrent requests are queued and coalesced into one model batch, until max_batch_pairs comments
+# or max_latency_ms after the first request of the batch; the model runs on one worker thread so the event loop keeps accepting
+class ScoringServer():
+    def __init__(self,ranker,max_batch_pairs=MAX_BATCH_PAIRS,max_latency_ms=MAX_LATENCY_MS):
+        self.ranker = ranker
+        self.max_batch_pairs = max_batch_pairs
+        self.max_latency = max_latency_ms/1000
+        self.executor = ThreadPoolExecutor(1)
+        self.queue = None
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.batch_requests = deque(maxlen=METRICS_WINDOW)
+        self.batch_pairs = deque(maxlen=METRICS_WINDOW)
+        self.request_count = 0
+        self.error_count = 0
+
+    async def submit(self,blog,comments):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(PendingRequest(blog,comments,future))
+        return await future
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            pairs = len(batch[0].comments)
+            deadline = loop.time()+self.max_latency
+            while pairs < self.max_batch_pairs:
+                timeout = deadline-loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(),timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                pairs += len(request.comments)
+            self.batch_requests.append(len(batch))
+            self.batch_pairs.append(pairs)
+
+            try:
+                results = await loop.run_in_executor(self.executor,self.run_batch,batch)
+            except Exception as e:
+                results = [e]*len(batch)
+            for request,result in zip(batch,results):
+                if request.future.done():
+                    continue
+                if isinstance(result,Exception):
+                    request.future.set_exception(result)
+                else:
+                    request.future.set_result(result)
+
+    # on the worker thread: the requests with an unknown blog fail alone, the others are scored in one batch
+    def run_batch(self,batch):
+        results = [None]*len(batch)
+        valid = []
+        for i,request in enumerate(batch):
+            try:
+                valid.append((i,self.ranker.title_of(request.blog)))
+            except KeyError as e:
+                results[i] = e
+        scores = self.ranker.score_many([(title,batch[i].comments) for i,title in valid])
+        for (i,_),request_scores in zip(valid,scores):
+            results[i] = request_scores
+        return results
+
+    def metrics(self):
+        latencies = np.array(self.latencies)*1000
+        return {'queue_depth':self.queue.qsize() if self.queue is not None else 0,
+                'requests':self.request_count,
+                'errors':self.error_count,
+                'batches':len(self.batch_requests),
+                'mean_batch_requests':float(np.mean(self.batch_requests)) if self.batch_requests else 0.0,
+                'mean_batch_pairs':float(np.mean(self.batch_pairs)) if self.batch_pairs else 0.0,
+                'max_batch_pairs':int(np.max(self.batch_pairs)) if self.batch_pairs else 0,
+                'latency_p50_ms':float(np.percentile(latencies,50)) if len(latencies) > 0 else 0.0,
+                'latency_p99_ms':float(np.percentile(latencies,99)) if len(latencies) > 0 else 0.0}
+
+    @staticmethod
+    def parse_request(body):
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise BadRequest('the body is not json')
+        if not isinstance(request,dict):
+            raise BadRequest('the body is not a json object')
+        comments = request.get('comments')
+        if not isinstance(comments,list) or not all(isinstance(comment,str) for comment in comments):
+            raise BadRequest('comments must be a list of strings')
+        # bool is a subclass of int, json true/false are not blog ids
+        if isinstance(request.get('blog_id'),int) and not isinstance(request['blog_id'],bool):
+            return request['blog_id'],comments
+        if isinstance(request.get('title'),str):
+            return request['title'],comments
+        raise BadRequest('blog_id (int) or title (str) is required')
+
+    async def respond(self,method,path,body):
+        if method == 'GET' and path == '/metrics':
+            return 200,self.metrics()
+        if method != 'POST' or path not in ['/score','/rank']:
+            return 404,{'error':'not found'}
+        blog,comments = self.parse_request(body)
+        start = time.perf_counter()
+        try:
+            scores = await self.submit(blog,comments)
+        except KeyError:
+            return 404,{'error':'blog %s is not found'%(blog)}
+        self.latencies.append(time.perf_counter()-start)
+        if path == '/score':
+            return 200,{'scores':scores.tolist()}
+        order = np.argsort(-scores,kind='stable')
+        return 200,{'ranked':[{'index':int(i),'comment':comments[i],'score':float(scores[i])} for i in order]}
+
+    async def handle(self,reader,writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key,_,value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            self.request_count += 1
+            try:
+                content_length = int(headers.get('content-length',0))
+            except ValueError:
+                content_length = -1
+            if len(request_line) < 2:
+                status,payload = 400,{'error':'bad request line'}
+            elif content_length < 0:
+                status,payload = 400,{'error':'bad content-length'}
+            elif content_length > MAX_BODY_BYTES:
+                status,payload = 413,{'error':'the body is larger than %d bytes'%(MAX_BODY_BYTES)}
+            else:
+                body = await reader.readexactly(content_length)
+                try:
+                    status,payload = await self.respond(request_line[0],request_line[1].split('?')[0],body)
+                except BadRequest as e:
+                    status,payload = 400,{'error':str(e)}
+                except Exception as e:
+                    status,payload = 500,{'error':repr(e)}
+            if status >= 400:
+                self.error_count += 1
+            data = json.dumps(payload,ensure_ascii=False).encode('utf-8')
+            writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                          %(status,STATUS_TEXT.get(status,''),len(data))).encode('latin-1')+data)
+            await writer.drain()
+        except (ConnectionError,asyncio.IncompleteReadError,ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self,host='127.0.0.1',port=8000):
+        self.queue = asyncio.Queue()
+        # the request texts are untrusted and rarely repeat, do not store them in the segment cache file
+        disable_cache()
+        # load jieba and the segmenter before the first request, without going through the title cache of the ranker
+        await asyncio.get_running_loop().run_in_executor(self.executor,preprocessing_blog_texts,['預熱'])
+        batcher = asyncio.ensure_future(self.batch_loop())
+        server = await asyncio.start_server(self.handle,host,port)
+        print('serving on http://%s:%d'%(host,port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='serve the scores of a PIXNETNET checkpoint over http')
+    parser.add_argument('-cpp','--checkpoint_path',required=True)
+    parser.add_argument('-db','--db_path',default=DB_FILE)
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',default=8000,type=int)
+    parser.add_argument('--max_batch_pairs',default=MAX_BATCH_PAIRS,type=int)
+    parser.add_argument('--max_latency_ms',default=MAX_LATENCY_MS,type=float)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    arg = parse()
+    server = ScoringServer(Ranker.from_checkpoint(arg.checkpoint_path,arg.db_path),arg.max_batch_pairs,arg.max_latency_ms)
+    asyncio.run(server.serve(arg.host,arg.port))
@@ -0,0 +1,157 @@
+import sqlite3
+import numpy as np
+from scipy import sparse
+
+DB_FILE2 = "wordDict.db"
+FETCH_ROWS = 100000
+
+class TFIDFMatrix():
+    '''
+        Sparse L2-normalized tf-idf matrix (blogs x words) of a tf-idf table, for the cosine similarity of blogs.
+    '''
+    def __init__(self, matrix, blogIDs):
+        '''
+            Create a TFIDFMatrix object, typically by TFIDFMatrix.build or TFIDFMatrix.load.
+
+            Parameters
+            ====================================
+
+            matrix  `scipy.sparse.csr_matrix`   - The L2-normalized tf-idf matrix, one row per blog.
+            blogIDs `np.ndarray`    - The sorted blog_id of each row.
+        '''
+        self.matrix = matrix
+        self.blogIDs = blogIDs
+
+    def getRows(self, blog_ids):
+        '''
+            Get the row indexes of the blogs.
+
+            Parameters
+            ====================================
+
+            blog_ids    `list[int]` - The blog_ids.
+
+            Returns
+            ====================================
+
+            `np.ndarray`  - The row indexes, -1 for the blogs not in the matrix.
+        '''
+        blog_ids = np.asarray(blog_ids, dtype=np.int64)
+        if len(self.blogIDs) == 0:
+            return np.full(len(blog_ids), -1)
+        rows = np.minimum(np.searchsorted(self.blogIDs, blog_ids), len(self.blogIDs) - 1)
+        return np.where(self.blogIDs[rows] == blog_ids, rows, -1)
+
+    def similarity(self, blog_id, candidate_ids):
+        '''
+            Get the cosine similarity between a blog and the candidate blogs with one sparse matrix-vector product.
+
+            Parameters
+            ====================================
+
+            blog_id         `int`       - The blog_id to compare with.
+            candidate_ids   `list[int]` - The candidate blog_ids.
+
+            Returns
+            ====================================
+
+            `np.ndarray`  - The similarity of each candidate, 0 if the blog or the candidate has no tf-idf words.
+        '''
+        scores = np.zeros(len(candidate_ids), dtype=np.float64)
+        queryRow = self.getRows([blog_id])[0]
+        if queryRow < 0 or len(candidate_ids) == 0:
+            return scores
+        rows = self.getRows(candidate_ids)
+        found = rows >= 0
+        scores[found] = (self.matrix[rows[found]] @ self.matrix[queryRow].T).toarray().ravel()
+        return scores
+
+    def rank(self, blog_id, candidate_ids):
+        '''
+            Sort the candidate blogs by descending cosine similarity, keeping the original order among equal scores.
+
+            Parameters
+            ====================================
+
+            blog_id         `int`       - The blog_id to compare with.
+            candidate_ids   `list[int]` - The candidate blog_ids.
+
+            Returns
+            ====================================
+
+            `list[int]`  - The indexes of candidate_ids in the ranked order.
+        '''
+        return np.argsort(-self.similarity(blog_id, candidate_ids), kind="stable").tolist()
+
+    def save(self, path):
+        '''
+            Save the matrix into a .npz file.
+
+            Parameters
+            ====================================
+
+            path    `str`   - The file path.
+        '''
+        np.savez(path, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr, shape=self.matrix.shape, blogIDs=self.blogIDs)
+
+    @staticmethod
+    def load(path):
+        '''
+            Load a matrix saved by TFIDFMatrix.save.
+
+            Parameters
+            ====================================
+
+            path    `str`   - The file path.
+
+            Returns
+            ====================================
+
+            `TFIDFMatrix`  - The matrix.
+        '''
+        with np.load(path) as f:
+            matrix = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return TFIDFMatrix(matrix, f["blogIDs"])
+
+    @staticmethod
+    def build(conn2 = sqlite3.connect(DB_FILE2), table = "blogs_tf_idf", blog_ids = None):
+        '''
+            Build the matrix from a tf-idf table of the word dictionary.
+
+            Parameters
+            ====================================
+
+            conn2   `sqlite3.Connection` - A SQLite connection object for the word dictionary. Default as the a new connection to the global DB_FILE2 databse file.
+            table   `str`   - "blogs_tf_idf" or "blogs_title_tf_idf".
+            blog_ids    `None|list[int]`  - Only load the rows of these blogs, all if None is given.
+
+            Returns
+            ====================================
+
+            `TFIDFMatrix`  - The matrix.
+        '''
+        cur2 = conn2.cursor()
+        if blog_ids is None:
+            cur2.execute("SELECT blog_id, word_id, tf_idf FROM " + table)
+        else:
+            cur2.execute("SELECT blog_id, word_id, tf_idf FROM " + table + " WHERE blog_id IN (" + ",".join([str(int(bi)) for bi in blog_ids]) + ")")
+
+        # Fetch by chunks to avoid holding the whole table as python tuples
+        chunks = []
+        while True:
+            rows = cur2.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+        triples = np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.float64)
+
+        blogIDs, rows = np.unique(triples[:, 0].astype(np.int64), return_inverse=True)
+        cols = triples[:, 1].astype(np.int64)
+        ncols = int(cols.max()) + 1 if len(cols) > 0 else 0
+        matrix = sparse.csr_matrix((triples[:, 2], (rows.ravel(), cols)), shape=(len(blogIDs), ncols))
+
+        # L2 normalization of each row
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+        return TFIDFMatrix(matrix.tocsr(), blogIDs)
@@ -49,6 +49,9 @@ class Trainer():
                 loss_history.append(loss.item())
             
             print('avg loss is :%.3f'%(np.array(loss_history).mean())) 
+            # real tokens / padded tokens of this epoch
+            if hasattr(train_X,'padding_efficiency'):
+                print('padding efficiency (title,comment) is :(%.3f,%.3f)'%train_X.padding_efficiency())
 
         
             if (epoch+1) % save_every == 0: